@@ -0,0 +1,467 @@
+import os
+import threading
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+
+import gameengine
+import headless
+from checkpoint import CheckpointManager, restore_model
+from metrics import MetricsWriter
+from movegen import InputCompiler
+
+
+def observation(features):
+    """Normalized agent input from PlayField.fetch_features, sent after every lock"""
+    return np.array([features['lines_cleared'], features['total_holes'], features['total_bumpiness'],
+                     features['max_height'], features['min_height'], features['current_piece_type'],
+                     features['next_piece_type']]) / 100
+
+
+def action_placement(field, placements, action):
+    """Placement for an agent action: rotation and column relative to spawn, or the closest reachable column"""
+    rotation, x = action % 4, action // 4 - 5
+    spawn_x, _, _ = field.spawn_position()
+    footprints = {frozenset(placement.cells()): placement for placement in placements}
+    for column in sorted(range(-3, field.cols), key=lambda c: abs(c - spawn_x - x)):
+        target = InputCompiler.footprint(field.game_field, field.current_piece_type, column, rotation)
+        if target in footprints:
+            return footprints[target]
+    return placements[0]
+
+
+def field_observation(field):
+    """observation of a headless field, the same view as during training: the features are sent right after
+    the previous lock, with the locked piece and the one to place next"""
+    features = field.fetch_features(len(field.last_cleared_rows))
+    features['current_piece_type'] = field.history[-1][0] if field.history else 0
+    features['next_piece_type'] = field.current_piece_type
+    return observation(features)
+
+
+def train_episode(agent, field, generator, max_pieces=None, learn=True):
+    """Play one headless game with an Agent from the current state of the field, learning from every placement
+    like EnvironmentManager does. Returns the episode statistics of headless, with the total agent reward.
+
+    Being blocked at spawn ends the game like a lock out, with its game over reward."""
+    state = field_observation(field)
+    total_reward = 0
+    placements = generator.field_placements(field)
+    while placements and not field.game_over and (max_pieces is None or field.pieces_placed < max_pieces):
+        action = int(agent.choose_action(state))
+        placement = action_placement(field, placements, action)
+        field.place_piece(placement.x, placement.y, placement.rotation)
+        reward = field.last_lock_reward
+        if not field.game_over:
+            placements = generator.field_placements(field)
+            if not placements:
+                field.game_over = True
+                reward += field.game_over_delta_score
+        new_state = field_observation(field)
+        if learn:
+            agent.learn(state, action, reward, new_state, field.game_over)
+        state = new_state
+        total_reward += reward
+    if not placements:
+        field.game_over = True
+    return dict(headless.episode_stats(field), reward=total_reward)
+
+
+class AgentPolicy:
+    """Headless policy playing the most likely action of a saved agent, see policies"""
+
+    def __init__(self, checkpoint=None, checkpoint_dir='checkpoints', greedy=True):
+        self.agent = Agent(alpha=0.0, beta=0.0, checkpoint_dir=checkpoint_dir)
+        if self.agent.load_models(checkpoint) is None:
+            raise FileNotFoundError(f'No checkpoint in {checkpoint_dir}' if checkpoint is None else checkpoint)
+        self.greedy = greedy
+
+    def choose(self, field, placements):
+        state = field_observation(field)
+        probabilities = self.agent.policy.predict(state[np.newaxis, :], verbose=0)[0]
+        if self.greedy:
+            action = int(np.argmax(probabilities))
+        else:
+            action = int(np.random.choice(self.agent.action_space, p=probabilities))
+        return action_placement(field, placements, action)
+
+
+class AgentWorker:
+    """Runs the inference and learning of an Agent on a background thread, so the game loop never waits on Keras.
+
+    request_action hands over an observation and returns at once, the chosen action is picked up with action.
+    Learning steps and other jobs go through a bounded queue, learning steps are dropped (counted in dropped)
+    when the worker falls behind. Action requests go first, only the latest one is answered. A job raising is
+    reported and recorded in error, a failed action request is answered with None."""
+
+    def __init__(self, agent, max_pending=64):
+        self.agent = agent
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        self.jobs = deque()
+        self.requested = None
+        self.requests = 0
+        self.answered = (0, None)
+        self.last_action = None
+        self.dropped = 0
+        self.error = None
+        self.stopping = False
+        # Set when the thread is gone, so waiters don't wait for answers that won't come
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name='agent-worker', daemon=True)
+        self.thread.start()
+
+    def request_action(self, observation):
+        """Ask for the action of an observation. Returns the request number to pass to action."""
+        with self.condition:
+            self.requests += 1
+            self.requested = (self.requests, observation)
+            self.condition.notify_all()
+            return self.requests
+
+    def action(self, request, timeout=0.0):
+        """Action chosen for a request, or None if it isn't ready within timeout seconds (None waits forever),
+        failed or the worker stopped."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.answered[0] >= request or self.stopped or not self.thread.is_alive(),
+                                    timeout)
+            number, action = self.answered
+            return action if number == request else None
+
+    def latest_action(self):
+        """Last action the worker chose, for any request. None before the first one."""
+        with self.condition:
+            return self.last_action
+
+    def add_transition(self, state, action, reward, new_state, done):
+        with self.condition:
+            if sum(job[0] is self.agent.learn for job in self.jobs) >= self.max_pending:
+                self.dropped += 1
+                return
+            self.jobs.append((self.agent.learn, (state, action, reward, new_state, done)))
+            self.condition.notify_all()
+
+    def call(self, function, *args):
+        """Run a function on the worker thread, after the queued learning steps. Never dropped."""
+        with self.condition:
+            self.jobs.append((function, args))
+            self.condition.notify_all()
+
+    def run(self):
+        try:
+            while True:
+                with self.condition:
+                    self.condition.wait_for(lambda: self.requested is not None or self.jobs or self.stopping)
+                    if self.requested is not None:
+                        request, self.requested = self.requested, None
+                        job = None
+                    elif self.jobs:
+                        job = self.jobs.popleft()
+                    else:
+                        return
+                if job is None:
+                    number, observation = request
+                    action = self.run_job(self.agent.choose_action, (observation,))
+                    with self.condition:
+                        self.answered = (number, action)
+                        if action is not None:
+                            self.last_action = action
+                        self.condition.notify_all()
+                else:
+                    self.run_job(*job)
+        finally:
+            with self.condition:
+                self.stopped = True
+                self.condition.notify_all()
+
+    def run_job(self, function, args):
+        """Call a job, None if it raised."""
+        try:
+            return function(*args)
+        except Exception as error:
+            self.error = error
+            print(f'... agent worker: {function.__name__} failed: {error!r} ...')
+            return None
+
+    def close(self):
+        """Finish the queued jobs and stop the thread."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+
+
+# Rotation 0 at the spawn column, where a piece nobody moves falls
+SPAWN_ACTION = 20
+# Default seconds an EnvironmentManager gives the agent to answer by action_policy. Only wait blocks the game
+# for them, the others keep the game running and fall back once they are over
+ACTION_TIMEOUTS = {'wait': 0.5, 'reuse': 0.1, 'default': 0.1}
+
+
+class EnvironmentManager(gameengine.Listener, gameengine.LogicObject):
+    """Plays and trains the agent in a game through its lock notifications, see PlayField.notify.
+
+    The agent runs on an AgentWorker. A lock only requests the action for the new piece, update picks the answer
+    up on a later frame and queues its keys from where the piece is by then. When the agent hasn't answered
+    within action_timeout seconds (ACTION_TIMEOUTS of the action_policy by default), the action_policy decides:
+    reuse plays the last action the agent chose and default plays default_action. wait is the opt-in blocking
+    policy: the lock waits for the answer up to action_timeout, then plays default_action."""
+
+    def __init__(self, learn=True, metrics_dir='metrics', metrics_format='jsonl', checkpoint_dir='checkpoints',
+                 checkpoint_every=10, action_policy='default', action_timeout=None, default_action=SPAWN_ACTION):
+        gameengine.Listener.__init__(self)
+        gameengine.LogicObject.__init__(self)
+        # Disable to only play with the current models
+        self.learn = learn
+        self.action_policy = action_policy
+        self.action_timeout = action_timeout if action_timeout is not None else ACTION_TIMEOUTS[action_policy]
+        self.default_action = default_action
+        # (request, deadline, field) of the falling piece until its action is played
+        self.pending = None
+        # (action, source) played for the falling piece, source being agent, reuse or default
+        self.played = None
+        self.score = 0
+        self.checkpoint_every = checkpoint_every
+        self.num_episodes = 1000
+        self.max_actions = 1000
+        self.score_history = []
+        self.agent = Agent(alpha=0.00001, beta=0.00005, checkpoint_dir=checkpoint_dir)
+        self.worker = AgentWorker(self.agent)
+        self.input_compiler = InputCompiler()
+        self.observation = self.get_default_observation()
+
+        # Metrics, streamed to disk by background writers. See metrics.plot to look at them
+        self.step_metrics = None
+        self.episode_metrics = None
+        if metrics_dir is not None:
+            self.step_metrics = MetricsWriter(os.path.join(metrics_dir, f'steps.{metrics_format}'))
+            self.episode_metrics = MetricsWriter(os.path.join(metrics_dir, f'episodes.{metrics_format}'))
+        self.steps = 0
+        self.episode_steps = 0
+        self.episode_start = perf_counter()
+        # Timestamps of the last steps, for the steps/sec rate
+        self.step_times = deque(maxlen=100)
+
+    def close(self):
+        """Finish the agent jobs, flush and stop the metrics and checkpoint writers"""
+        self.worker.close()
+        for writer in (self.step_metrics, self.episode_metrics):
+            if writer is not None:
+                writer.close()
+        self.agent.checkpoints.close()
+
+    def training_state(self):
+        """Counters saved with the models"""
+        return {'steps': self.steps, 'episodes': len(self.score_history), 'score_history': self.score_history}
+
+    def save(self):
+        # On the worker, so the weights aren't copied in the middle of a fit
+        self.worker.call(self.agent.save_models, self.steps, self.training_state())
+
+    def resume(self, path=None):
+        """Restore the models, optimizers, epsilon and counters of a checkpoint, the latest by default"""
+        state = self.agent.load_models(path)
+        if state is not None:
+            self.steps = state['steps']
+            self.score_history = [float(score) for score in state['score_history']]
+            print(f'Resumed at episode {len(self.score_history)}, step {self.steps}')
+
+    def get_default_observation(self):
+        return np.array([0, 0, 0, 0, 0, 0, 0])
+
+    @property
+    def busy(self):
+        return self.pending is not None
+
+    def fallback_action(self):
+        """Action and its source when the agent didn't answer in time, following action_policy"""
+        if self.action_policy == 'reuse':
+            action = self.worker.latest_action()
+            if action is not None:
+                return action, 'reuse'
+        return self.default_action, 'default'
+
+    def update(self, dt: float):
+        """Play the action of the falling piece once the agent answered or the timeout is over"""
+        if self.pending is None:
+            return
+        request, deadline, field = self.pending
+        action = self.worker.action(request, 0)
+        source = 'agent'
+        if action is None:
+            if self.action_policy != 'wait' and perf_counter() < deadline:
+                return
+            action, source = self.fallback_action()
+        self.pending = None
+        self.played = (action, source)
+        # Queue the shortest key sequence from where the piece is now, x is relative to the spawn column
+        rotation, x = action % 4, action // 4 - 5
+        spawn_x, _, _ = field.spawn_position()
+        keys = self.input_compiler.compile_nearest(field.game_field, field.current_piece_type,
+                                                   (field.current_piece_x, field.current_piece_y,
+                                                    field.current_piece_rotation.get()), spawn_x + x, rotation)
+        gameengine.AGENT_KEY_QUEUE.add_keys(keys if keys is not None else ("hard_drop",))
+
+    def step(self, event: gameengine.Event):
+        """Step function. Control flow is managed by the game engine."""
+        if event.message == 'game_over':
+            done = True
+        else:
+            done = False
+        new_observation, reward = observation(event.params['features']), event.params['features']['reward']
+        # What was played for the piece that just locked, it fell from the spawn column if nothing was in time
+        if self.pending is not None:
+            action, action_source = SPAWN_ACTION, 'none'
+        elif self.played is not None:
+            action, action_source = self.played
+        else:
+            # Start of a game, no piece locked yet
+            action, action_source = None, None
+        self.pending = None
+        self.played = None
+        if not done:
+            request = self.worker.request_action(new_observation)
+            if self.action_policy == 'wait':
+                self.worker.action(request, self.action_timeout)
+            # Played by update, from a later frame
+            self.pending = (request, perf_counter() + self.action_timeout, event.params['field'])
+        # The reward is the one of the piece placed with that action
+        if self.learn and action is not None:
+            self.worker.add_transition(self.observation, action, reward, new_observation, done)
+        self.observation = new_observation
+        self.score += reward
+
+        features = event.params['features']
+        now = perf_counter()
+        self.steps += 1
+        self.episode_steps += 1
+        self.step_times.append(now)
+        steps_per_sec = (len(self.step_times) - 1) / (now - self.step_times[0]) if len(self.step_times) > 1 else 0.0
+        if self.step_metrics is not None:
+            self.step_metrics.log(step=self.steps, episode=len(self.score_history) + 1, reward=float(reward),
+                                  lines=int(features['lines_cleared']), epsilon=float(self.agent.epsilon),
+                                  steps_per_sec=steps_per_sec, action=int(action) if action is not None else -1,
+                                  action_source=action_source or 'none')
+        if done:
+            self.score_history.append(self.score)
+            if self.episode_metrics is not None:
+                duration = now - self.episode_start
+                self.episode_metrics.log(episode=len(self.score_history), reward=float(self.score),
+                                         score=int(features['score']), lines=int(features['total_lines']),
+                                         pieces=int(features['pieces_placed']), steps=self.episode_steps,
+                                         epsilon=float(self.agent.epsilon),
+                                         steps_per_sec=self.episode_steps / duration if duration > 0 else 0.0)
+            self.score = 0
+            self.episode_steps = 0
+            self.episode_start = now
+            print(f'Episode {len(self.score_history)} finished with score {self.score_history[-1]}')
+            if self.learn and len(self.score_history) % self.checkpoint_every == 0:
+                self.save()
+            if len(self.score_history) == self.num_episodes:
+                print('Finished training')
+                if self.learn:
+                    self.save()
+            gameengine.AGENT_KEY_QUEUE.add_key("restart")
+
+
+class Agent:
+    def __init__(self,
+                 alpha, beta, gamma=0.99, epsilon=0.1, epsilon_decay=0.99975, epsilon_min=0.01,
+                 n_actions=40,
+                 layer1_size=16, layer2_size=16,
+                 # lines_cleared, holes, bumpiness,
+                 # max_height, min_height, current_piece_type, next_piece_type
+                 input_dims=7,
+                 checkpoint_dir='checkpoints', keep_checkpoints=3,
+                 env=None):
+        gameengine.Listener.__init__(self)
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoints = CheckpointManager(checkpoint_dir, keep_checkpoints)
+        self.env = env
+        self.gamma = gamma
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.epsilon_decay = epsilon_decay
+        self.epsilon_min = epsilon_min
+        self.n_actions = n_actions
+        self.input_dims = input_dims
+        self.fc1_dims = layer1_size
+        self.fc2_dims = layer2_size
+
+        self.actor, self.critic, self.policy = self.build_actor_critic_network()
+        self.action_space = [i for i in range(self.n_actions)]
+
+    def build_actor_critic_network(self):
+        # Keras is imported here, it takes seconds and only training and evaluation need it
+        from keras.layers import Dense, Input
+        from keras.models import Model
+        from keras.optimizers import Adam
+
+        input = Input(shape=(self.input_dims,))
+        # Actor specific
+        delta = Input(shape=[1])
+        dense1 = Dense(self.fc1_dims, activation='relu')(input)
+        dense2 = Dense(self.fc2_dims, activation='relu')(dense1)
+        # Actor & policy specific
+        probs = Dense(self.n_actions, activation='softmax')(dense2)
+        # Critic specific
+        values = Dense(1, activation='linear')(dense2)
+
+        actor = Model(inputs=[input, delta], outputs=[probs])
+        actor.compile(optimizer=Adam(learning_rate=self.alpha), loss='mean_squared_error')
+        critic = Model(inputs=[input], outputs=[values])
+        critic.compile(optimizer=Adam(learning_rate=self.beta), loss='mean_squared_error')
+        policy = Model(inputs=[input], outputs=[probs])
+
+        return actor, critic, policy
+
+    def choose_action(self, observation):
+        state = observation[np.newaxis, :]
+        probabilities = self.policy.predict(state)[0]
+        # TODO: remove epsilon-greedy and use temperature
+        if np.random.random() < self.epsilon:
+            action = np.random.choice(self.action_space)
+        else:
+            action = np.random.choice(self.action_space, p=probabilities)
+        self.epsilon = max(self.epsilon * self.epsilon_decay, self.epsilon_min)
+        return action
+
+    def learn(self, state, action, reward, new_state, done):
+        state = state[None, :]
+        new_state = new_state[None, :]
+
+        new_critic_value = self.critic.predict(new_state)
+        critic_value = self.critic.predict(state)
+
+        # Calculate advantage
+        target = reward + self.gamma * new_critic_value * (1 - int(done))
+        delta = target - critic_value
+
+        actions = np.zeros([1, self.n_actions])
+        actions[np.arange(1), action] = 1.0
+
+        # Train actor
+        self.actor.fit([state, delta], actions, verbose=0)
+        # Train critic
+        self.critic.fit(state, target, verbose=0)
+
+    def save_models(self, step=0, state=None):
+        """Snapshot the models, optimizers and epsilon, written in the background. See CheckpointManager"""
+        print('... saving models ...')
+        state = dict(state if state is not None else {}, epsilon=self.epsilon)
+        self.checkpoints.save(step, {'actor': self.actor, 'critic': self.critic}, state)
+
+    def load_models(self, path=None):
+        """Restore a checkpoint, the latest by default. Returns its saved state, None without checkpoint"""
+        print('... loading models ...')
+        loaded = self.checkpoints.load(path)
+        if loaded is None:
+            print('... no checkpoint found ...')
+            return None
+        snapshots, state = loaded
+        restore_model(self.actor, snapshots['actor'])
+        restore_model(self.critic, snapshots['critic'])
+        self.epsilon = state['epsilon']
+        return state
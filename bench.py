@@ -0,0 +1,234 @@
+import argparse
+import json
+import platform
+import sys
+from time import perf_counter
+
+import numpy as np
+import pygame as pg
+
+import commons
+import gameengine
+import grid
+import headless
+import kernels
+from gameengine import Event, Listener, Notifier
+from grid import Rotation
+from movegen import MoveGenerator, search_placements
+from policies import HeuristicPolicy
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark setup. It gets the seed and returns (run, operations per run call).
+    When the operation count is None, run returns it."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def random_board(rng, rows=40, cols=10, height=12, fill=0.7, full_rows=2):
+    """Board with a random stack of the given height, some of its rows full."""
+    cells = np.zeros((rows, cols), dtype=np.int8)
+    stack = (rng.random((height, cols)) < fill) * rng.choice(grid.PIECE_TYPES, (height, cols))
+    stack[rng.choice(height, full_rows, replace=False)] = ord('X')
+    cells[rows - height:] = stack
+    return cells
+
+
+@benchmark('can_show_piece')
+def setup_can_show_piece(seed):
+    rng = np.random.default_rng(seed)
+    field = headless.make_field(seed=seed)
+    field.game_field.cells[:] = random_board(rng)
+    field.game_field.update_surface()
+    queries = [(int(rng.choice(grid.PIECE_TYPES)), Rotation(int(rng.integers(4))), int(rng.integers(-2, 10)),
+                int(rng.integers(0, 20))) for _ in range(64)]
+
+    def run():
+        for piece_type, rotation, x, y in queries:
+            field.game_field.can_show_piece(piece_type, rotation, x, y)
+    return run, len(queries)
+
+
+@benchmark('clean_rows')
+def setup_clean_rows(seed):
+    field = headless.make_field(seed=seed)
+    board = random_board(np.random.default_rng(seed), full_rows=4)
+
+    def run():
+        field.game_field.cells[:] = board
+        field.game_field.update_surface()
+        field.clean_rows()
+    return run, 1
+
+
+@benchmark('fetch_features')
+def setup_fetch_features(seed):
+    field = headless.make_field(seed=seed)
+    field.game_field.cells[:] = random_board(np.random.default_rng(seed), full_rows=0)
+    field.game_field.update_surface()
+
+    def run():
+        field.fetch_features(0)
+    return run, 1
+
+
+@benchmark('display_grid_draw')
+def setup_display_grid_draw(seed):
+    headless.init()
+    display_grid = grid.DisplayGrid(0, 0, 10, 40, 24, 1, commons.color_theme_default)
+    display_grid.cells[:] = random_board(np.random.default_rng(seed), full_rows=0)
+    display_grid.update_surface()
+
+    def run():
+        # Full redraw, not the unchanged cells shortcut
+        display_grid.drawn_cells = None
+        display_grid.draw()
+    return run, 1
+
+
+@benchmark('frame_draw_unchanged')
+def setup_frame_draw_unchanged(seed):
+    import game
+
+    headless.init()
+    pg.display.init()
+    screen = pg.display.set_mode((commons.width, commons.height))
+    # Only the game scene, even when the setup is called outside measure: the cost is the cached background
+    # layer and the unchanged grids, not objects of other benchmarks
+    gameengine.reset()
+    game.init_objs(seed=seed)
+    game.draw(screen)
+
+    def run():
+        game.draw(screen)
+    return run, 1
+
+
+@benchmark('notifier_dispatch')
+def setup_notifier_dispatch(seed):
+    notifier = Notifier()
+    listeners = [Listener() for _ in range(8)]
+    for listener in listeners:
+        notifier.connect(Event("bench"), listener, lambda event: None)
+    event = Event("bench")
+
+    def run():
+        notifier.notify(event)
+    return run, len(listeners)
+
+
+@benchmark('playfield_update_idle')
+def setup_playfield_update_idle(seed):
+    field = headless.make_field(seed=seed)
+
+    def run():
+        # No key down, the piece only falls on its timer
+        for _ in range(100):
+            field.update(1 / commons.target_fps)
+    return run, 100
+
+
+@benchmark('move_generation')
+def setup_move_generation(seed):
+    field = headless.make_field(seed=seed)
+    field.game_field.cells[:] = random_board(np.random.default_rng(seed), full_rows=0)
+    field.game_field.update_surface()
+    x, y, rotation = field.spawn_position()
+
+    def run():
+        for piece_type in grid.PIECE_TYPES:
+            search_placements(field.game_field, piece_type, x, y, rotation)
+    return run, len(grid.PIECE_TYPES)
+
+
+@benchmark('episode_pieces')
+def setup_episode(seed, pieces=200):
+    field = headless.make_field(seed=seed)
+    policy = HeuristicPolicy()
+
+    def run():
+        field.rng = np.random.default_rng(seed)
+        field.start_game()
+        headless.run_episode(field, policy, MoveGenerator(), max_pieces=pieces)
+        return field.pieces_placed
+    return run, None
+
+
+def measure(setup, seed, min_time=0.5, repeats=5):
+    """Median seconds per operation over repeats, each running for about min_time / repeats."""
+    # Fields, grids and timers register themselves globally, drop the ones of the previous benchmarks
+    gameengine.reset()
+    run, ops = setup(seed)
+    # Calibrate the number of calls per repeat
+    start = perf_counter()
+    result = run()
+    elapsed = perf_counter() - start
+    calls = max(1, int(min_time / repeats / max(elapsed, 1e-9)))
+    samples = []
+    for _ in range(repeats):
+        total_ops = 0
+        start = perf_counter()
+        for _ in range(calls):
+            result = run()
+            total_ops += result if ops is None else ops
+        samples.append((perf_counter() - start) / total_ops)
+    per_op = float(np.median(samples))
+    return {'seconds_per_op': per_op, 'ops_per_sec': 1.0 / per_op,
+            'spread': float((max(samples) - min(samples)) / per_op), 'repeats': repeats, 'calls': calls}
+
+
+def run_benchmarks(names=None, seed=0, min_time=0.5):
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if names and name not in names:
+            continue
+        results[name] = measure(setup, seed, min_time)
+        print(f'{name:24} {results[name]["ops_per_sec"]:14.1f} ops/s  '
+              f'({results[name]["seconds_per_op"] * 1e6:.2f} us/op)')
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__, 'pygame': pg.version.ver,
+                     'platform': platform.platform(), 'seed': seed, 'kernels': kernels.ENABLED},
+            'results': results}
+
+
+def compare(current, baseline, threshold=0.1):
+    """Benchmarks slower than the baseline by more than threshold (relative). Returns the regressions."""
+    regressions = {}
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            continue
+        ratio = result['ops_per_sec'] / baseline['results'][name]['ops_per_sec']
+        status = 'REGRESSION' if ratio < 1 - threshold else 'ok'
+        print(f'{name:24} {ratio:6.2f}x  {status}')
+        if status != 'ok':
+            regressions[name] = ratio
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless benchmarks of the engine hot paths.')
+    parser.add_argument('names', nargs='*', help=f'benchmarks to run, all by default: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds spent per benchmark')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown flagged as regression')
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.names, args.seed, args.min_time)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(current, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(current, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
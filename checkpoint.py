@@ -0,0 +1,144 @@
+import json
+import os
+import queue
+import threading
+
+import numpy as np
+
+CHECKPOINT_PREFIX = 'checkpoint-'
+CHECKPOINT_SUFFIX = '.npz'
+
+
+def optimizer_variables(optimizer):
+    """Variables of a Keras optimizer, across Keras versions."""
+    variables = optimizer.variables
+    return list(variables() if callable(variables) else variables)
+
+
+def snapshot_model(model):
+    """In-memory copy of the weights and optimizer state of a compiled Keras model."""
+    return {'weights': [np.array(w) for w in model.get_weights()],
+            'optimizer': [np.array(v) for v in optimizer_variables(model.optimizer)]}
+
+
+def restore_model(model, snapshot):
+    model.set_weights(snapshot['weights'])
+    if not snapshot['optimizer']:
+        return
+    variables = optimizer_variables(model.optimizer)
+    if len(variables) != len(snapshot['optimizer']) and hasattr(model.optimizer, 'build'):
+        # Optimizer slots are created lazily, on the first training step
+        model.optimizer.build(model.trainable_variables)
+        variables = optimizer_variables(model.optimizer)
+    if len(variables) != len(snapshot['optimizer']):
+        print('... optimizer state does not match, starting with a fresh optimizer ...')
+        return
+    for variable, value in zip(variables, snapshot['optimizer']):
+        variable.assign(value)
+
+
+class CheckpointManager:
+    """Saves training snapshots to a directory without blocking training.
+
+    save copies the weights in memory and returns, a background thread serializes the copy to a temporary
+    file and atomically renames it. Only the last keep checkpoints are kept. If a snapshot is still
+    waiting when the next one comes, the older one is skipped."""
+
+    def __init__(self, directory, keep=3):
+        self.directory = directory
+        self.keep = keep
+        self.queue = queue.Queue(maxsize=1)
+        self.thread = None
+        self.error = None
+
+    def path(self, step):
+        return os.path.join(self.directory, f'{CHECKPOINT_PREFIX}{step:010d}{CHECKPOINT_SUFFIX}')
+
+    def checkpoints(self):
+        """Paths of the complete checkpoints, oldest first."""
+        if not os.path.isdir(self.directory):
+            return []
+        names = sorted(name for name in os.listdir(self.directory)
+                       if name.startswith(CHECKPOINT_PREFIX) and name.endswith(CHECKPOINT_SUFFIX))
+        return [os.path.join(self.directory, name) for name in names]
+
+    def latest(self):
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def save(self, step, models: dict, state: dict):
+        """Snapshot models (name -> Keras model) and a JSON-serializable state, and queue them for writing."""
+        snapshot = (step, {name: snapshot_model(model) for name, model in models.items()}, state)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='checkpoint-writer', daemon=True)
+            self.thread.start()
+        while True:
+            try:
+                self.queue.put_nowait(snapshot)
+                return
+            except queue.Full:
+                # Replace the snapshot the writer hasn't started on yet
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def run(self):
+        while True:
+            snapshot = self.queue.get()
+            if snapshot is None:
+                break
+            try:
+                self.write(*snapshot)
+            except Exception as error:
+                # Keep the writer alive, close and the next checkpoints must not wait on a dead thread
+                self.error = error
+                print(f'... checkpoint failed: {error} ...')
+
+    def write(self, step, snapshots, state):
+        os.makedirs(self.directory, exist_ok=True)
+        arrays = {'state': np.array(json.dumps(state))}
+        for name, snapshot in snapshots.items():
+            for kind in ('weights', 'optimizer'):
+                for i, value in enumerate(snapshot[kind]):
+                    arrays[f'{name}/{kind}/{i}'] = value
+        path = self.path(step)
+        temporary = path + '.tmp'
+        with open(temporary, 'wb') as file:
+            np.savez(file, **arrays)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+        for old in self.checkpoints()[:-self.keep]:
+            os.remove(old)
+
+    def load(self, path=None):
+        """Read a checkpoint, the latest by default. Returns (model snapshots by name, state) or None."""
+        path = path if path is not None else self.latest()
+        if path is None:
+            return None
+        snapshots = {}
+        with np.load(path) as data:
+            state = json.loads(str(data['state']))
+            for key in data.files:
+                if key == 'state':
+                    continue
+                name, kind, index = key.split('/')
+                snapshot = snapshots.setdefault(name, {'weights': {}, 'optimizer': {}})
+                snapshot[kind][int(index)] = data[key]
+        for snapshot in snapshots.values():
+            for kind in ('weights', 'optimizer'):
+                snapshot[kind] = [snapshot[kind][i] for i in range(len(snapshot[kind]))]
+        return snapshots, state
+
+    def close(self):
+        """Wait for the pending checkpoint to be written."""
+        if self.thread is not None:
+            while self.thread.is_alive():
+                try:
+                    self.queue.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            self.thread.join()
+            self.thread = None
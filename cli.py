@@ -0,0 +1,243 @@
+"""TetrAI command line. Heavy libraries are only imported by the subcommands needing them."""
+import argparse
+import sys
+
+
+def add_game_arguments(parser):
+    parser.add_argument('--seed', type=int, default=None, help='piece sequence seed')
+    parser.add_argument('--record', help='save the played games to this file, see replay')
+    parser.add_argument('--profile', help='profile frames and export the timings to this file')
+    parser.add_argument('--profile-hud', action='store_true', help='show the profiler timings on screen')
+    parser.add_argument('--das', type=float, default=None,
+                        help='seconds before a held move key repeats, off by default (moves repeat every 0.1s)')
+    parser.add_argument('--arr', type=float, default=0.03, help='seconds between auto repeats with --das')
+
+
+def add_action_arguments(parser):
+    parser.add_argument('--action-policy', choices=('wait', 'reuse', 'default'), default='default',
+                        help='when the agent has no action ready in time for a new piece: play the default one '
+                             '(the spawn column), reuse its last action, or wait for it, stalling the game')
+    parser.add_argument('--action-timeout', type=float, default=None,
+                        help='seconds the agent gets to answer before --action-policy applies, '
+                             '0.5 with wait and 0.1 otherwise by default')
+
+
+def add_render_argument(parser):
+    parser.add_argument('--render', choices=('window', 'process', 'none'), default='window',
+                        help='window draws in lockstep with the game, process draws snapshots in another process '
+                             'so the game runs at full speed, none does not draw')
+
+
+def run_game(args, environment=None, agent_mode=False):
+    import game
+    from replay import Recorder
+
+    recorder = None
+
+    def setup(field):
+        nonlocal recorder
+        if args.record:
+            recorder = Recorder(field, args.seed)
+
+    game.run(environment, agent_mode, args.seed, args.profile, args.profile_hud, setup,
+             getattr(args, 'render', 'window'), args.das, args.arr)
+    if recorder is not None:
+        recorder.save(args.record)
+
+
+def play(args):
+    run_game(args)
+
+
+def train(args):
+    from agent import EnvironmentManager
+
+    environment = EnvironmentManager(metrics_dir=args.metrics_dir, metrics_format=args.metrics_format,
+                                     checkpoint_dir=args.checkpoint_dir, checkpoint_every=args.checkpoint_every,
+                                     action_policy=args.action_policy, action_timeout=args.action_timeout)
+    if args.resume:
+        environment.resume()
+    try:
+        run_game(args, environment, agent_mode=True)
+    finally:
+        environment.close()
+
+
+def evaluate(args):
+    if not args.watch:
+        import evaluate as evaluation
+
+        evaluation.main(args.policy or ['heuristic'], args.games, args.seed, args.workers, args.max_pieces,
+                        args.confidence, args.output)
+        return
+
+    from agent import EnvironmentManager
+
+    environment = EnvironmentManager(learn=False, metrics_dir=None, checkpoint_dir=args.checkpoint_dir,
+                                     action_policy=args.action_policy, action_timeout=args.action_timeout)
+    environment.agent.load_models(args.checkpoint)
+    try:
+        run_game(args, environment, agent_mode=True)
+    finally:
+        environment.close()
+
+
+def replay(args):
+    import game
+    import replay as replays
+
+    recording = replays.load(args.file)
+
+    def setup(field):
+        replays.Replayer(field, recording['games'][args.game], args.delay)
+
+    game.run(seed=recording['seed'], setup=setup)
+
+
+def plot(args):
+    import metrics
+
+    metrics.plot(args.files, args.x, args.y, args.output, args.smoothing)
+
+
+def dataset(args):
+    import dataset as datasets
+
+    manifest = datasets.generate(args.output, args.policy, args.games, args.workers, args.shard_size, args.seed,
+                                 args.max_pieces)
+    print(f'{manifest["records"]} records in {len(manifest["shards"])} shards written to {args.output}')
+
+
+def bench(args):
+    import bench as benchmarks
+
+    return benchmarks.main(args.extra_args)
+
+
+def watch(args):
+    import watch as watching
+
+    watching.main(args.games, args.policy, args.workers, args.seed, args.fps, args.cell_size, args.max_pieces)
+
+
+def sweep(args):
+    import sweep as sweeps
+
+    sweeps.main(args.space, args.search, args.trials, args.output, args.episodes, args.workers, args.seed,
+                args.max_pieces, args.metric, args.grace, args.window)
+
+
+def serve(args):
+    import server
+
+    server.serve(args.address, args.envs)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='tetrai', description=__doc__)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    play_parser = subparsers.add_parser('play', help='play with the keyboard')
+    add_game_arguments(play_parser)
+    play_parser.set_defaults(handler=play)
+
+    train_parser = subparsers.add_parser('train', help='train the actor-critic agent in the game window')
+    add_game_arguments(train_parser)
+    train_parser.add_argument('--resume', action='store_true', help='continue from the latest checkpoint')
+    add_render_argument(train_parser)
+    add_action_arguments(train_parser)
+    train_parser.add_argument('--checkpoint-dir', default='checkpoints')
+    train_parser.add_argument('--checkpoint-every', type=int, default=10, help='episodes between checkpoints')
+    train_parser.add_argument('--metrics-dir', default='metrics', help='where steps and episodes metrics go')
+    train_parser.add_argument('--metrics-format', choices=('jsonl', 'csv'), default='jsonl')
+    train_parser.set_defaults(handler=train)
+
+    eval_parser = subparsers.add_parser('eval', help='evaluate policies on fixed seeds with headless games')
+    eval_parser.add_argument('--policy', action='append',
+                             help='random, heuristic, search or checkpoint:<path>. Repeat to compare')
+    eval_parser.add_argument('--games', type=int, default=100, help='games, seeded --seed onwards')
+    eval_parser.add_argument('--workers', type=int, default=None, help='processes, one per core by default')
+    eval_parser.add_argument('--max-pieces', type=int, default=None, help='pieces per game limit')
+    eval_parser.add_argument('--confidence', type=float, default=0.95, help='confidence interval level')
+    eval_parser.add_argument('--output', help='write the reports as JSON')
+    eval_parser.add_argument('--watch', action='store_true', help='watch the saved agent in the window instead')
+    add_game_arguments(eval_parser)
+    eval_parser.set_defaults(seed=0)
+    eval_parser.add_argument('--checkpoint-dir', default='checkpoints')
+    eval_parser.add_argument('--checkpoint', help='checkpoint file for --watch, the latest by default')
+    add_render_argument(eval_parser)
+    add_action_arguments(eval_parser)
+    eval_parser.set_defaults(handler=evaluate)
+
+    replay_parser = subparsers.add_parser('replay', help='replay games saved with --record')
+    replay_parser.add_argument('file')
+    replay_parser.add_argument('--game', type=int, default=0, help='index of the game in the file')
+    replay_parser.add_argument('--delay', type=float, default=0.25, help='seconds between pieces')
+    replay_parser.set_defaults(handler=replay)
+
+    plot_parser = subparsers.add_parser('plot', help='plot metrics files written by train')
+    plot_parser.add_argument('files', nargs='+')
+    plot_parser.add_argument('--x', default='episode', help='column on the x axis')
+    plot_parser.add_argument('--y', nargs='+', default=['score', 'lines', 'reward'], help='columns to plot')
+    plot_parser.add_argument('--output', help='save to an image instead of showing a window')
+    plot_parser.add_argument('--smoothing', type=int, default=1, help='moving average window')
+    plot_parser.set_defaults(handler=plot)
+
+    dataset_parser = subparsers.add_parser('dataset', help='generate an offline dataset from headless games')
+    dataset_parser.add_argument('output', help='dataset directory')
+    dataset_parser.add_argument('--policy', choices=('random', 'heuristic', 'search'), default='heuristic')
+    dataset_parser.add_argument('--games', type=int, default=100)
+    dataset_parser.add_argument('--workers', type=int, default=None, help='processes, one per core by default')
+    dataset_parser.add_argument('--shard-size', type=int, default=10000, help='records per shard')
+    dataset_parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    dataset_parser.add_argument('--max-pieces', type=int, default=None, help='pieces per game limit')
+    dataset_parser.set_defaults(handler=dataset)
+
+    watch_parser = subparsers.add_parser('watch', help='watch many headless games at once as a mosaic')
+    watch_parser.add_argument('--games', type=int, default=36)
+    watch_parser.add_argument('--policy', default='heuristic', help='random, heuristic, search or checkpoint:<path>')
+    watch_parser.add_argument('--workers', type=int, default=None, help='processes, one per core by default')
+    watch_parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    watch_parser.add_argument('--fps', type=int, default=10, help='mosaic refreshes per second')
+    watch_parser.add_argument('--cell-size', type=int, default=4, help='pixels per cell of the thumbnails')
+    watch_parser.add_argument('--max-pieces', type=int, default=None, help='pieces before a game starts over')
+    watch_parser.set_defaults(handler=watch)
+
+    serve_parser = subparsers.add_parser('serve', help='serve headless environments to agents over a socket')
+    serve_parser.add_argument('--envs', type=int, default=16, help='number of environments')
+    serve_parser.add_argument('--address', default='127.0.0.1:5555', help='<host>:<port> or unix:<path>')
+    serve_parser.set_defaults(handler=serve)
+
+    sweep_parser = subparsers.add_parser('sweep', help='tune the agent and reward parameters on headless games')
+    sweep_parser.add_argument('--space', help='search space JSON file, see sweep.py, a small default one otherwise')
+    sweep_parser.add_argument('--search', choices=('grid', 'random'), default='grid')
+    sweep_parser.add_argument('--trials', type=int, default=20, help='parameter sets sampled with --search random')
+    sweep_parser.add_argument('--episodes', type=int, default=100, help='training games per trial')
+    sweep_parser.add_argument('--max-pieces', type=int, default=None, help='pieces per game limit')
+    sweep_parser.add_argument('--workers', type=int, default=None, help='processes, one per core by default')
+    sweep_parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    sweep_parser.add_argument('--metric', choices=('score', 'lines', 'pieces', 'reward'), default='score',
+                              help='episode metric trials are ranked and stopped on')
+    sweep_parser.add_argument('--grace', type=int, default=20, help='episodes before a trial can be stopped')
+    sweep_parser.add_argument('--window', type=int, default=10, help='episodes of the running mean')
+    sweep_parser.add_argument('--output', default='sweeps', help='directory of the results and trial metrics')
+    sweep_parser.set_defaults(handler=sweep)
+
+    # Arguments are forwarded to bench.py
+    bench_parser = subparsers.add_parser('bench', help='run the headless benchmarks, see bench.py --help',
+                                         add_help=False)
+    bench_parser.set_defaults(handler=bench, forward_args=True)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args, extra_args = parser.parse_known_args(argv)
+    if extra_args and not getattr(args, 'forward_args', False):
+        parser.error(f'unrecognized arguments: {" ".join(extra_args)}')
+    args.extra_args = extra_args
+    return args.handler(args) or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
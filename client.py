@@ -0,0 +1,82 @@
+import socket
+
+import numpy as np
+
+import protocol
+
+
+class ServerError(RuntimeError):
+    pass
+
+
+class EnvironmentClient:
+    """Steps the environments of a server, see server.py. Only needs numpy.
+
+    Observations come back as structured arrays of protocol.observation_dtype, one row per environment."""
+
+    def __init__(self, address='127.0.0.1:5555'):
+        family, connect_address = protocol.parse_address(address)
+        self.connection = socket.socket(family, socket.SOCK_STREAM)
+        self.connection.connect(connect_address)
+        if family == socket.AF_INET:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.envs, self.rows, self.cols, self.preview = protocol.INFO_REPLY.unpack(self.request(protocol.INFO))
+        self.observation_dtype = protocol.observation_dtype(self.rows, self.cols, self.preview)
+
+    def request(self, opcode, items=None):
+        """Send a request and return the reply payload after the status."""
+        parts = [bytes([opcode])]
+        if items is not None:
+            parts += [protocol.COUNT.pack(len(items)), items.tobytes()]
+        protocol.send_message(self.connection, *parts)
+        reply = protocol.receive_message(self.connection)
+        if reply[0] != protocol.OK:
+            raise ServerError(reply[1:].decode())
+        return memoryview(reply)[1:]
+
+    def env_ids(self, envs):
+        return np.arange(self.envs) if envs is None else np.asarray(envs)
+
+    def reset(self, envs=None, seeds=None):
+        """Start new games, all environments by default. A seed of None or -1 draws a random one."""
+        envs = self.env_ids(envs)
+        items = np.zeros(len(envs), dtype=protocol.RESET_ITEM)
+        items['env'] = envs
+        items['seed'] = -1 if seeds is None else [-1 if seed is None else seed for seed in seeds]
+        return np.frombuffer(self.request(protocol.RESET, items), dtype=self.observation_dtype)
+
+    def step(self, placements, envs=None):
+        """Lock a piece in each environment at an (x, y, rotation) placement. Returns rewards, dones, observations.
+
+        Environments whose game is over are left as they are and report done again."""
+        envs = self.env_ids(envs)
+        placements = np.asarray(placements).reshape(len(envs), 3)
+        items = np.zeros(len(envs), dtype=protocol.STEP_ITEM)
+        items['env'] = envs
+        items['x'], items['y'], items['rotation'] = placements.T
+        reply = self.request(protocol.STEP, items)
+        results = np.frombuffer(reply, dtype=protocol.STEP_RESULT, count=len(envs))
+        observations = np.frombuffer(reply, dtype=self.observation_dtype, offset=results.nbytes)
+        return results['reward'], results['done'].astype(bool), observations
+
+    def placements(self, envs=None):
+        """Resting placements of the current piece, as a structured array of protocol.PLACEMENT per environment."""
+        envs = self.env_ids(envs)
+        reply = self.request(protocol.PLACEMENTS, np.asarray(envs, dtype=protocol.ENV_ID))
+        placements = []
+        offset = 0
+        for _ in envs:
+            count, = protocol.COUNT.unpack_from(reply, offset)
+            offset += protocol.COUNT.size
+            placements.append(np.frombuffer(reply, dtype=protocol.PLACEMENT, count=count, offset=offset))
+            offset += count * protocol.PLACEMENT.itemsize
+        return placements
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,7 +1,5 @@
 import pygame as pg
 
-from gameengine import Key
-
 width = 800
 height = 600
 target_fps = 60
@@ -22,28 +20,20 @@ color_theme_default = {'name': "default", 'palette': {
     "background": (120, 120, 120)
 }}
 
+# Action -> pygame key. PlayFields bind their keys with gameengine.INPUT when they are created
 key_binds = {
-    'clockwise': Key(pg.K_e),
-    'counter_clockwise': Key(pg.K_q),
-    'switch': Key(pg.K_w),
-    'hard_drop': Key(pg.K_SPACE),
-    'soft_drop': Key(pg.K_DOWN),
-    'left': Key(pg.K_LEFT),
-    'right': Key(pg.K_RIGHT),
-    '180': Key(pg.K_p),
-    'pause': Key(pg.K_ESCAPE),
-    'restart': Key(pg.K_r),
+    'clockwise': pg.K_e,
+    'counter_clockwise': pg.K_q,
+    'switch': pg.K_w,
+    'hard_drop': pg.K_SPACE,
+    'soft_drop': pg.K_DOWN,
+    'left': pg.K_LEFT,
+    'right': pg.K_RIGHT,
+    '180': pg.K_p,
+    'pause': pg.K_ESCAPE,
+    'restart': pg.K_r,
 }
 
-agent_key_binds = {
-    'clockwise': Key(pg.K_e, input_mode="agent"),
-    'counter_clockwise': Key(pg.K_q, input_mode="agent"),
-    'switch': Key(pg.K_w, input_mode="agent"),
-    'hard_drop': Key(pg.K_SPACE, input_mode="agent"),
-    'soft_drop': Key(pg.K_DOWN, input_mode="agent"),
-    'left': Key(pg.K_LEFT, input_mode="agent"),
-    'right': Key(pg.K_RIGHT, input_mode="agent"),
-    '180': Key(pg.K_p, input_mode="agent"),
-    'pause': Key(pg.K_ESCAPE, input_mode="agent"),
-    'restart': Key(pg.K_r, input_mode="agent"),
-}
\ No newline at end of file
+
+def get_key_binds():
+    return dict(key_binds)
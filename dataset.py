@@ -0,0 +1,172 @@
+import json
+import multiprocessing
+import os
+
+import numpy as np
+
+import headless
+from movegen import MoveGenerator
+from policies import POLICIES, board_features
+
+MANIFEST = 'manifest.json'
+
+
+def record_fields(rows=40, cols=10, preview=5):
+    """Name -> (dtype, shape) of one record."""
+    return {'board': (np.int8, (rows, cols)),
+            'current_piece': (np.uint8, ()),
+            'preview': (np.uint8, (preview,)),
+            # 0 when nothing is held
+            'hold': (np.uint8, ()),
+            # x, y, rotation. Placements never use the hold piece
+            'placement': (np.int8, (3,)),
+            'reward': (np.float32, ()),
+            # lines cleared, holes, bumpiness, aggregate height, max height, after the placement
+            'features': (np.float32, (5,))}
+
+
+class ShardWriter:
+    """Buffers records in fixed-size arrays and writes them as .npy shards, one file per field.
+
+    Memory use is bounded by one shard. Files are written under a temporary name and renamed."""
+
+    def __init__(self, directory, prefix, shard_size=10000, fields=None):
+        self.directory = directory
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.fields = fields if fields is not None else record_fields()
+        self.buffers = {name: np.zeros((shard_size,) + shape, dtype=dtype)
+                        for name, (dtype, shape) in self.fields.items()}
+        self.count = 0
+        self.shards = []
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, **record):
+        for name, value in record.items():
+            self.buffers[name][self.count] = value
+        self.count += 1
+        if self.count == self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if self.count == 0:
+            return
+        name = f'{self.prefix}-{len(self.shards):05d}'
+        for field, buffer in self.buffers.items():
+            path = os.path.join(self.directory, f'{name}.{field}.npy')
+            with open(path + '.tmp', 'wb') as file:
+                np.save(file, buffer[:self.count])
+            os.replace(path + '.tmp', path)
+        self.shards.append({'name': name, 'records': self.count})
+        self.count = 0
+
+
+def generate_games(directory, prefix, policy_name, seeds, shard_size=10000, max_pieces=None):
+    """Play one game per seed and stream its placements into shards. Returns the written shards."""
+    field = headless.make_field()
+    policy = POLICIES[policy_name]()
+    generator = MoveGenerator()
+    writer = ShardWriter(directory, prefix, shard_size, record_fields(field.rows, field.cols, field.max_next_pieces))
+
+    for seed in seeds:
+        field.rng = np.random.default_rng(seed)
+        if hasattr(policy, 'rng'):
+            # Stochastic policies play the same on the same seed, so the manifest is enough to rebuild a dataset
+            policy.rng = np.random.default_rng(seed)
+        field.start_game()
+        while not field.game_over and (max_pieces is None or field.pieces_placed < max_pieces):
+            placements = generator.field_placements(field)
+            if not placements:
+                # Blocked at spawn
+                break
+            placement = policy.choose(field, placements)
+            board = field.game_field.cells.copy()
+            current_piece, preview = field.current_piece_type, field.bag[:field.max_next_pieces]
+            hold = field.hold_piece_type if field.hold_piece_type is not None else 0
+            lines = field.total_lines
+            field.place_piece(placement.x, placement.y, placement.rotation)
+            height, holes, bumpiness, max_height = board_features(field.game_field.cells[np.newaxis])
+            writer.append(board=board, current_piece=current_piece, preview=preview, hold=hold,
+                          placement=(placement.x, placement.y, placement.rotation),
+                          reward=field.last_lock_reward,
+                          features=(field.total_lines - lines, holes[0], bumpiness[0], height[0], max_height[0]))
+    writer.flush()
+    return writer.shards
+
+
+def _generate_worker(args):
+    return generate_games(*args)
+
+
+def generate(directory, policy_name='heuristic', games=100, workers=None, shard_size=10000, seed=0,
+             max_pieces=None):
+    """Generate a dataset from headless games in parallel processes and write its manifest."""
+    workers = workers if workers is not None else os.cpu_count()
+    seeds = [seed + i for i in range(games)]
+    jobs = [(directory, f'shard-w{worker:03d}', policy_name, seeds[worker::workers], shard_size, max_pieces)
+            for worker in range(workers) if seeds[worker::workers]]
+    if len(jobs) == 1:
+        results = [_generate_worker(jobs[0])]
+    else:
+        with multiprocessing.get_context('spawn').Pool(len(jobs)) as pool:
+            results = pool.map(_generate_worker, jobs)
+    shards = [shard for result in results for shard in result]
+    fields = record_fields()
+    manifest = {'policy': policy_name, 'games': games, 'seed': seed, 'max_pieces': max_pieces,
+                'records': sum(shard['records'] for shard in shards),
+                'fields': {name: {'dtype': np.dtype(dtype).str, 'shape': list(shape)}
+                           for name, (dtype, shape) in fields.items()},
+                'shards': shards}
+    with open(os.path.join(directory, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+class ShardDataset:
+    """Reads a generated dataset by memory-mapping its shards."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as file:
+            self.manifest = json.load(file)
+        self.fields = list(self.manifest['fields'])
+
+    def __len__(self):
+        return self.manifest['records']
+
+    def shard(self, name):
+        return {field: np.load(os.path.join(self.directory, f'{name}.{field}.npy'), mmap_mode='r')
+                for field in self.fields}
+
+    def batches(self, batch_size, shuffle=True, seed=None, drop_last=False):
+        """Yield dicts of field arrays. Shards are visited in random order and shuffled within."""
+        rng = np.random.default_rng(seed)
+        shards = [shard['name'] for shard in self.manifest['shards']]
+        if shuffle:
+            rng.shuffle(shards)
+        pending = None
+        for name in shards:
+            arrays = self.shard(name)
+            count = len(arrays[self.fields[0]])
+            order = rng.permutation(count) if shuffle else np.arange(count)
+            start = 0
+            if pending is not None:
+                # Complete the batch left over from the previous shard
+                missing = batch_size - len(pending[self.fields[0]])
+                extra = np.sort(order[:missing])
+                pending = {field: np.concatenate([pending[field], arrays[field][extra]]) for field in self.fields}
+                start = len(extra)
+                if len(pending[self.fields[0]]) < batch_size:
+                    continue
+                yield pending
+                pending = None
+            while start < count:
+                indices = np.sort(order[start:start + batch_size])
+                batch = {field: arrays[field][indices] for field in self.fields}
+                start += batch_size
+                if len(indices) < batch_size:
+                    pending = batch
+                else:
+                    yield batch
+        if pending is not None and not drop_last:
+            yield pending
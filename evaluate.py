@@ -0,0 +1,124 @@
+import json
+import multiprocessing
+import os
+from time import perf_counter
+
+import numpy as np
+
+import headless
+from movegen import MoveGenerator
+
+# Set in every worker by init_worker
+_policy = None
+_generator = None
+_field = None
+
+
+def make_policy(spec):
+    """Policy from a spec: random, heuristic, search, or checkpoint:<path> for a saved agent."""
+    if spec.startswith('checkpoint:'):
+        from agent import AgentPolicy
+
+        path = spec[len('checkpoint:'):]
+        return AgentPolicy(path, os.path.dirname(path))
+    from policies import POLICIES
+
+    return POLICIES[spec]()
+
+
+def init_worker(spec):
+    global _policy, _generator, _field
+    _policy = make_policy(spec)
+    _generator = MoveGenerator()
+    _field = headless.make_field()
+
+
+def play_game(args):
+    seed, max_pieces = args
+    start = perf_counter()
+    _field.rng = np.random.default_rng(seed)
+    if hasattr(_policy, 'rng'):
+        # Stochastic policies play the same on the same seed
+        _policy.rng = np.random.default_rng(seed)
+    _field.start_game()
+    stats = headless.run_episode(_field, _policy, _generator, max_pieces)
+    stats['seed'] = seed
+    stats['seconds'] = perf_counter() - start
+    return stats
+
+
+def bootstrap_ci(values, confidence=0.95, resamples=2000, seed=0):
+    """Percentile bootstrap confidence interval of the mean. Seeded, so reports are reproducible."""
+    values = np.asarray(values, dtype=np.float64)
+    if len(values) < 2:
+        return float(values.mean()), float(values.mean())
+    rng = np.random.default_rng(seed)
+    means = values[rng.integers(0, len(values), (resamples, len(values)))].mean(axis=1)
+    alpha = (1 - confidence) / 2
+    low, high = np.quantile(means, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def summarize(values, confidence=0.95):
+    values = np.asarray(values, dtype=np.float64)
+    low, high = bootstrap_ci(values, confidence)
+    p10, median, p90 = np.percentile(values, [10, 50, 90])
+    return {'mean': float(values.mean()), 'std': float(values.std()), 'min': float(values.min()),
+            'p10': float(p10), 'median': float(median), 'p90': float(p90), 'max': float(values.max()),
+            'ci_low': low, 'ci_high': high}
+
+
+def evaluate(spec, seeds, workers=None, max_pieces=None, confidence=0.95):
+    """Play one headless game per seed with a policy, across a process pool, and report distributions."""
+    workers = min(workers if workers is not None else os.cpu_count(), len(seeds))
+    jobs = [(seed, max_pieces) for seed in seeds]
+    start = perf_counter()
+    if workers <= 1:
+        init_worker(spec)
+        games = [play_game(job) for job in jobs]
+    else:
+        with multiprocessing.get_context('spawn').Pool(workers, init_worker, (spec,)) as pool:
+            games = pool.map(play_game, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+    wall_time = perf_counter() - start
+    games.sort(key=lambda game: game['seed'])
+    # Share of the cleared lines that came from Tetrises
+    tetris_rates = [4 * game['tetrises'] / game['lines'] if game['lines'] else 0.0 for game in games]
+    total_pieces = sum(game['pieces'] for game in games)
+    return {'policy': spec, 'games': len(games), 'max_pieces': max_pieces, 'confidence': confidence,
+            'score': summarize([game['score'] for game in games], confidence),
+            'lines': summarize([game['lines'] for game in games], confidence),
+            'pieces': summarize([game['pieces'] for game in games], confidence),
+            'tetris_rate': summarize(tetris_rates, confidence),
+            'wall_time': wall_time, 'workers': workers,
+            'pieces_per_sec': total_pieces / wall_time, 'games_per_sec': len(games) / wall_time,
+            'per_game': games}
+
+
+def print_report(report):
+    print(f'{report["policy"]}: {report["games"]} games, {report["workers"]} workers, '
+          f'{report["wall_time"]:.1f}s, {report["pieces_per_sec"]:.0f} pieces/s')
+    for metric in ('score', 'lines', 'pieces', 'tetris_rate'):
+        stats = report[metric]
+        print(f'  {metric:12} mean {stats["mean"]:10.2f}  '
+              f'[{stats["ci_low"]:.2f}, {stats["ci_high"]:.2f}]  '
+              f'median {stats["median"]:10.2f}  p10 {stats["p10"]:10.2f}  p90 {stats["p90"]:10.2f}')
+
+
+def main(specs, games=100, seed=0, workers=None, max_pieces=None, confidence=0.95, output=None):
+    """Evaluate policies on the same seeds, games seed, seed + 1, ..."""
+    seeds = list(range(seed, seed + games))
+    reports = []
+    for spec in specs:
+        report = evaluate(spec, seeds, workers, max_pieces, confidence)
+        print_report(report)
+        reports.append(report)
+    if len(reports) == 2:
+        # Paired on seeds
+        differences = [b['score'] - a['score'] for a, b in zip(reports[0]['per_game'], reports[1]['per_game'])]
+        low, high = bootstrap_ci(differences, confidence)
+        print(f'score difference ({reports[1]["policy"]} - {reports[0]["policy"]}): '
+              f'{np.mean(differences):.2f} [{low:.2f}, {high:.2f}]')
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(reports, file, indent=2)
+    return reports
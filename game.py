@@ -1,43 +1,74 @@
-import os
+from time import perf_counter
 
 import pygame as pg
-from matplotlib import pyplot as plt
 
 import commons
 import gameengine
 import grid
-from gameengine import CanvasObject
+import headless
+import profiler
+from pacing import FrameScheduler
+from gameengine import CanvasObject, InputState, KeyQueue
+from render import RenderProcess, snapshot
 
-from keras import backend as K
-from keras.layers import Dense, Input
-from keras.models import Model
-from keras.optimizers import Adam
-import numpy as np
+RENDER_MODES = ('window', 'process', 'none')
 
 
 def handle_input():
-    gameengine.KEYS = pg.key.get_pressed()
+    now = perf_counter()
+    gameengine.INPUT.begin_frame()
     for event in pg.event.get():
         match event.type:
             case pg.QUIT:
-                gameengine.game_running = False
+                commons.game_running = False
             case pg.KEYDOWN:
+                gameengine.INPUT.key_down(event.key, now)
                 match event.key:
                     case pg.K_ESCAPE:
-                        gameengine.game_running = False
+                        commons.game_running = False
+            case pg.KEYUP:
+                gameengine.INPUT.key_up(event.key)
+            case pg.WINDOWFOCUSLOST:
+                # Key ups go to the other window
+                gameengine.INPUT.release_all()
+            case pg.WINDOWEXPOSED | pg.VIDEOEXPOSE | pg.WINDOWRESTORED:
+                # The window contents were lost, redraw even if the scene didn't change
+                gameengine.invalidate()
+    gameengine.INPUT.end_frame(now)
 
 
 def update(dt):
+    if gameengine.PROFILER is None:
+        for obj in gameengine.LOGIC_OBJECTS:
+            obj.update(dt)
+        return
     for obj in gameengine.LOGIC_OBJECTS:
+        start = perf_counter()
         obj.update(dt)
+        gameengine.PROFILER.add('update', type(obj).__name__, perf_counter() - start)
 
 
 def draw(screen: pg.Surface):
-    for obj in gameengine.CANVAS_OBJECTS[::-1]:
-        if obj.invisible:
+    for layer in gameengine.RENDER_GRAPH:
+        if layer.static:
+            if gameengine.PROFILER is None:
+                screen.blit(layer.composite(screen.get_size()), (0, 0))
+            else:
+                start = perf_counter()
+                screen.blit(layer.composite(screen.get_size()), (0, 0))
+                gameengine.PROFILER.add('draw', f'layer:{layer.name}', perf_counter() - start)
             continue
-        obj.draw()
-        screen.blit(obj.image, obj.rect)
+        for obj in layer.objects:
+            if obj.invisible:
+                continue
+            if gameengine.PROFILER is None:
+                obj.draw()
+                screen.blit(obj.image, obj.rect)
+            else:
+                start = perf_counter()
+                obj.draw()
+                screen.blit(obj.image, obj.rect)
+                gameengine.PROFILER.add('draw', type(obj).__name__, perf_counter() - start)
     pg.display.flip()
 
 
@@ -49,213 +80,122 @@ def init_screen():
     return screen
 
 
-def init_objs():
+def init_objs(environment=None, agent_mode=False, seed=None, das=None, arr=None):
+    # Created first so agent keys are dequeued before the field reads them
     gameengine.AGENT_KEY_QUEUE = KeyQueue()
-    background = CanvasObject(0, 0, commons.width, commons.height)
+    gameengine.INPUT = InputState(das, arr)
+    background = CanvasObject(0, 0, commons.width, commons.height, layer='background')
     background.image.fill(commons.color_theme_default['palette']['background'])
-    background.draw_level = 0
+    background.invalidate()
     cell_size = 24
     cell_margin = 1
-    env_manager = EnvironmentManager()
     game_grid = grid.PlayField(commons.width // 2, commons.height // 2, cell_size, cell_margin,
-                               commons.color_theme_default, commons.key_binds,
+                               commons.color_theme_default, commons.get_key_binds(),
                                play_field_offset=(-((cell_size + cell_margin) * 5 + cell_margin // 2),
                                                   -((cell_size + cell_margin) * 30 + cell_margin // 2)),
                                hold_field_offset=(-((cell_size + cell_margin) * 11 + cell_margin // 2),
                                                   -((cell_size + cell_margin) * 10 + cell_margin // 2)),
                                next_field_offset=(((cell_size + cell_margin) * 7 + cell_margin // 2),
                                                   -((cell_size + cell_margin) * 10 + cell_margin // 2)),
-                               environment=env_manager, agent_mode=True)
+                               environment=environment, agent_mode=agent_mode, seed=seed)
     gameengine.FIELD = game_grid
-
-
-class KeyQueue(gameengine.LogicObject):
-    def __init__(self):
-        super().__init__()
-        self.queue = []
-        self.max_size = 100
-        self.current_key = None
-
-    def update(self, dt):
-        if len(self.queue) > 0:
-            self.current_key = self.queue.pop(0)
-        else:
-            self.current_key = None
-
-    def add_key(self, key):
-        if len(self.queue) < self.max_size:
-            self.queue.append(key)
-
-    def get_key(self):
-        return self.current_key
-
-
-class EnvironmentManager(gameengine.Listener):
-    def __init__(self):
-        gameengine.Listener.__init__(self)
-        self.score = 0
-        self.num_episodes = 1000
-        self.max_actions = 1000
-        self.score_history = []
-        self.agent = Agent(alpha=0.00001, beta=0.00005)
-        self.observation = self.get_default_observation()
-
-    def get_default_observation(self):
-        return np.array([0, 0, 0, 0, 0, 0, 0])
-
-    def step(self, event: gameengine.Event):
-        print(event.message)
-        """Step function. Control flow is managed by the game engine."""
-        if event.message == 'game_over':
-            done = True
-        else:
-            done = False
-        new_observation, reward = [event.params['features']['lines_cleared'], event.params['features']['total_holes'],
-                                   event.params['features']['total_bumpiness'], event.params['features']['max_height'],
-                                   event.params['features']['min_height'],
-                                   event.params['features']['current_piece_type'],
-                                   event.params['features']['next_piece_type']], event.params['features']['reward'],
-        # Normalize observation
-        new_observation = np.array(new_observation) / 100
-        action = self.agent.choose_action(self.observation)
-        rotation, x = action % 4, action // 4 - 5
-        print(f'Chosen rotation: {rotation}, x: {x}')
-        # TODO: Prevent excessive centering
-
-        # Queue action
-        for _ in range(rotation):
-            gameengine.AGENT_KEY_QUEUE.add_key("clockwise")
-        if x >= 0:
-            for _ in range(x+1):
-                gameengine.AGENT_KEY_QUEUE.add_key("right")
-        elif x < 0:
-            for _ in range(abs(x)):
-                gameengine.AGENT_KEY_QUEUE.add_key("left")
-        gameengine.AGENT_KEY_QUEUE.add_key("hard_drop")
-        self.observation = new_observation
-        self.score += reward
-        self.agent.learn(self.observation, action, reward, new_observation, done)
-        if done:
-            self.score_history.append(self.score)
-            self.score = 0
-            print(f'Episode {len(self.score_history)} finished with score {self.score_history[-1]}')
-            if len(self.score_history) % 100 == 0:
-                plt.plot(self.score_history)
-                plt.show()
-                self.agent.save_models()
-            if len(self.score_history) == self.num_episodes:
-                print('Finished training')
-                self.agent.save_models()
-            gameengine.AGENT_KEY_QUEUE.add_key("restart")
-
-
-class Agent:
-    def __init__(self,
-                 alpha, beta, gamma=0.99, epsilon=0.1, epsilon_decay=0.99975, epsilon_min=0.01,
-                 n_actions=40,
-                 layer1_size=16, layer2_size=16,
-                 # lines_cleared, holes, bumpiness,
-                 # max_height, min_height, current_piece_type, next_piece_type
-                 input_dims=7,
-                 checkpoint_dir=f'C:{os.sep}Users{os.sep}master{os.sep}PycharmProjects{os.sep}tetrai',
-                 env=None):
-        gameengine.Listener.__init__(self)
-        self.checkpoint_dir = checkpoint_dir
-        self.env = env
-        self.gamma = gamma
-        self.alpha = alpha
-        self.beta = beta
-        self.epsilon = epsilon
-        self.epsilon_decay = epsilon_decay
-        self.epsilon_min = epsilon_min
-        self.n_actions = n_actions
-        self.input_dims = input_dims
-        self.fc1_dims = layer1_size
-        self.fc2_dims = layer2_size
-
-        self.actor, self.critic, self.policy = self.build_actor_critic_network()
-        self.action_space = [i for i in range(self.n_actions)]
-
-    def build_actor_critic_network(self):
-        input = Input(shape=(self.input_dims,))
-        # Actor specific
-        delta = Input(shape=[1])
-        dense1 = Dense(self.fc1_dims, activation='relu')(input)
-        dense2 = Dense(self.fc2_dims, activation='relu')(dense1)
-        # Actor & policy specific
-        probs = Dense(self.n_actions, activation='softmax')(dense2)
-        # Critic specific
-        values = Dense(1, activation='linear')(dense2)
-
-        actor = Model(inputs=[input, delta], outputs=[probs])
-        actor.compile(optimizer=Adam(learning_rate=self.alpha), loss='mean_squared_error')
-        critic = Model(inputs=[input], outputs=[values])
-        critic.compile(optimizer=Adam(learning_rate=self.beta), loss='mean_squared_error')
-        policy = Model(inputs=[input], outputs=[probs])
-
-        return actor, critic, policy
-
-    def choose_action(self, observation):
-        state = observation[np.newaxis, :]
-        probabilities = self.policy.predict(state)[0]
-        # TODO: remove epsilon-greedy and use temperature
-        if np.random.random() < self.epsilon:
-            action = np.random.choice(self.action_space)
-        else:
-            action = np.random.choice(self.action_space, p=probabilities)
-        self.epsilon = max(self.epsilon * self.epsilon_decay, self.epsilon_min)
-        return action
-
-    def learn(self, state, action, reward, new_state, done):
-        state = state[None, :]
-        new_state = new_state[None, :]
-
-        new_critic_value = self.critic.predict(new_state)
-        critic_value = self.critic.predict(state)
-
-        # Calculate advantage
-        target = reward + self.gamma * new_critic_value * (1 - int(done))
-        delta = target - critic_value
-
-        actions = np.zeros([1, self.n_actions])
-        actions[np.arange(1), action] = 1.0
-
-        # Train actor
-        self.actor.fit([state, delta], actions, verbose=0)
-        # Train critic
-        self.critic.fit(state, target, verbose=0)
-
-    def save_models(self):
-        print('... saving models ...')
-        if not os.path.exists(self.checkpoint_dir):
-            os.makedirs(self.checkpoint_dir)
-
-        self.actor.save_weights(os.path.join(self.checkpoint_dir, 'actor.h5'))
-        self.critic.save_weights(os.path.join(self.checkpoint_dir, 'critic.h5'))
-
-    def load_models(self):
-        print('... loading models ...')
-        self.actor.load_weights(self.actor.checkpoint_file)
-        self.critic.load_weights(self.critic.checkpoint_file)
-
-
-# Init app
-pg.init()
-
-# Init screen
-screen = init_screen()
-
-init_objs()
-
-clock = pg.time.Clock()
-delta_time = 0.0
-commons.game_running = True
-
-# Event loop
-while commons.game_running:
-    handle_input()
-    update(delta_time)
-    draw(screen)
-
-    delta_time = 0.001 * clock.tick(commons.target_fps)
-pg.quit()
+    return game_grid
+
+
+def run_decoupled(field, renderer=None, profile_path=None):
+    """Game loop without a window, at a fixed frame time but as fast as it can.
+
+    Snapshots go to the renderer at most target_fps times a second of wall time."""
+    delta_time = 1 / commons.target_fps
+    next_snapshot = 0.0
+    try:
+        while commons.game_running:
+            frame_start = perf_counter()
+            handle_input()
+            input_end = perf_counter()
+            update(delta_time)
+            update_end = perf_counter()
+            if renderer is not None and update_end >= next_snapshot:
+                if renderer.closed:
+                    break
+                renderer.submit(snapshot(field))
+                next_snapshot = update_end + delta_time
+            snapshot_end = perf_counter()
+            if gameengine.PROFILER is not None:
+                gameengine.PROFILER.record_frame(handle_input=input_end - frame_start, update=update_end - input_end,
+                                                 draw=snapshot_end - update_end)
+                if gameengine.PROFILER.frames % gameengine.PROFILER.window == 0:
+                    gameengine.PROFILER.export(profile_path)
+    except KeyboardInterrupt:
+        pass
+
+
+def run(environment=None, agent_mode=False, seed=None, profile_path=None, profile_hud=False, setup=None,
+        render='window', das=None, arr=None):
+    """Open the window and run the game loop until it is closed.
+
+    setup(field) is called once the objects exist, e.g. to attach recorders.
+    render is window (drawn in lockstep, throttled to target_fps), process (drawn from snapshots by another
+    process, see render.RenderProcess) or none. Without a window the keyboard isn't read.
+    das and arr (seconds) turn on auto repeat of held keys, see gameengine.InputState."""
+    renderer = None
+    if render != 'window':
+        if render == 'process':
+            # Started before going windowless, so the renderer still gets a display
+            renderer = RenderProcess()
+        headless.init()
+
+    # Init app
+    pg.init()
+
+    # Init screen
+    screen = init_screen() if render == 'window' else None
+
+    field = init_objs(environment, agent_mode, seed, das, arr)
+    if setup is not None:
+        setup(field)
+
+    # Opt-in profiling
+    if profile_path:
+        profiler.enable(hud=profile_hud)
+
+    delta_time = 0.0
+    commons.game_running = True
+
+    # Event loop
+    if screen is None:
+        run_decoupled(field, renderer, profile_path)
+    scheduler = FrameScheduler(commons.target_fps, always_draw=profile_hud)
+    while screen is not None and commons.game_running:
+        frame_start = scheduler.begin_frame()
+        handle_input()
+        input_end = perf_counter()
+        update(delta_time)
+        update_end = perf_counter()
+        if scheduler.should_draw():
+            draw(screen)
+        draw_end = perf_counter()
+
+        delta_time = scheduler.wait()
+        if gameengine.PROFILER is not None:
+            gameengine.PROFILER.record_frame(handle_input=input_end - frame_start, update=update_end - input_end,
+                                             draw=draw_end - update_end, tick=perf_counter() - draw_end)
+            if gameengine.PROFILER.frames % gameengine.PROFILER.window == 0:
+                gameengine.PROFILER.export(profile_path)
+    if screen is not None:
+        pacing = scheduler.summary()
+        print(f'{pacing["frames"]} frames, {pacing["drawn_frames"]} drawn, '
+              f'duty cycle {100 * pacing["duty_cycle"]:.1f}%')
+    if renderer is not None:
+        renderer.close()
+    if gameengine.PROFILER is not None:
+        gameengine.PROFILER.export(profile_path)
+    pg.quit()
+    return field
+
+
+if __name__ == '__main__':
+    import cli
+
+    # Historical entry point, trains the agent
+    cli.main(['train'])
@@ -1,31 +1,109 @@
-from pygame import Surface, Rect, image
-import pygame as pg
+import bisect
+from collections import deque
+from time import perf_counter
+
+from pygame import Surface, Rect, image, SRCALPHA
 FIELD = None
 LOGIC_OBJECTS = []
-# Draw order is maintained by the draw_level property
-CANVAS_OBJECTS = []
-# Human, keyboard input
-KEYS = []
-# AI, neural network input
-AGENT_KEYS = {pg.K_e: False,
-              pg.K_q: False,
-              pg.K_w: False,
-              pg.K_SPACE: False,
-              pg.K_DOWN: False,
-              pg.K_LEFT: False,
-              pg.K_RIGHT: False,
-              pg.K_p: False,
-              pg.K_ESCAPE: False,
-              pg.K_r: False}
+# Human, keyboard input. See InputState, it is fed by the game loop
+INPUT = None
+# AI input, agent key presses
 AGENT_KEY_QUEUE = None
 NOTIFIERS = {}
 """ Contains notifiers by id """
 # Example: {'1': {'1': [method1, method2]}
 LISTENERS = {}
+# Opt-in frame profiler, see profiler.FrameProfiler
+PROFILER = None
+# Bumped whenever what is on screen changes, see invalidate
+SCENE_VERSION = 0
+
+
+def invalidate():
+    """Tell the game loop the scene needs to be drawn again, see pacing.FrameScheduler"""
+    global SCENE_VERSION
+    SCENE_VERSION += 1
+
+
+def reset():
+    """Forget every registered object and input, e.g. between independent runs in one process"""
+    global FIELD, INPUT, AGENT_KEY_QUEUE
+    FIELD = None
+    INPUT = None
+    AGENT_KEY_QUEUE = None
+    LOGIC_OBJECTS.clear()
+    NOTIFIERS.clear()
+    LISTENERS.clear()
+    for layer in RENDER_GRAPH:
+        layer.objects.clear()
+        layer.invalidate()
+
+
+class RenderLayer:
+    """Named group of canvas objects, kept sorted by draw level.
+
+    A static layer is composited once into a cached surface, and again only after invalidate, e.g. when one
+    of its objects changes its image."""
+
+    def __init__(self, name, level, static=False):
+        self.name = name
+        self.level = level
+        self.static = static
+        self.objects = []
+        self.cache = None
+
+    def add(self, obj):
+        # After the objects of the same level, like a stable sort
+        bisect.insort_right(self.objects, obj, key=lambda o: o.draw_level)
+        self.invalidate()
+
+    def remove(self, obj):
+        self.objects.remove(obj)
+        self.invalidate()
+
+    def invalidate(self):
+        self.cache = None
+        invalidate()
+
+    def composite(self, size):
+        """The cached surface of a static layer, rebuilt if it was invalidated."""
+        if self.cache is None or self.cache.get_size() != size:
+            self.cache = Surface(size, SRCALPHA)
+            for obj in self.objects:
+                if not obj.invisible:
+                    obj.draw()
+                    self.cache.blit(obj.image, obj.rect)
+        return self.cache
+
+
+class RenderGraph:
+    """Layers of canvas objects, drawn by increasing level. See RENDER_GRAPH"""
+
+    def __init__(self):
+        self.layers = []
+        self.layers_by_name = {}
+
+    def add_layer(self, name, level, static=False):
+        layer = RenderLayer(name, level, static)
+        bisect.insort_right(self.layers, layer, key=lambda l: l.level)
+        self.layers_by_name[name] = layer
+        return layer
+
+    def layer(self, name):
+        return self.layers_by_name[name]
+
+    def __iter__(self):
+        return iter(self.layers)
+
+
+# Draw order: layers by level, then objects by draw_level
+RENDER_GRAPH = RenderGraph()
+RENDER_GRAPH.add_layer('background', 0, static=True)
+RENDER_GRAPH.add_layer('main', 1)
 
 
 class CanvasObject:
-    def __init__(self, x, y, width: int = None, height: int = None, image: image = None):
+    def __init__(self, x, y, width: int = None, height: int = None, image: image = None, layer='main'):
         self.__draw_level = 0
         if image is None:
             self.image = Surface((width, height))
@@ -35,27 +113,35 @@ class CanvasObject:
         self.rect.move_ip(x, y)
         self.invisible = False
         super(CanvasObject, self).__init__()
-        CANVAS_OBJECTS.append(self)
+        self.layer = RENDER_GRAPH.layer(layer)
+        self.layer.add(self)
 
     @property
     def draw_level(self):
         return self.__draw_level
 
-    # Draw order
+    # Draw order within the layer
     @draw_level.setter
     def draw_level(self, level: int):
+        self.layer.remove(self)
         self.__draw_level = level
-        super(CanvasObject, self).__init__()
-        CANVAS_OBJECTS.sort(key=lambda x: x.draw_level, reverse=True)
+        self.layer.add(self)
 
     def draw(self):
         pass
 
+    def invalidate(self):
+        """Call after changing what a static layer object shows"""
+        self.layer.invalidate()
+
     def kill(self):
-        CANVAS_OBJECTS.remove(self)
+        self.layer.remove(self)
 
 
 class LogicObject:
+    # Whether it needs frames to run even when nothing happens, see pacing.FrameScheduler
+    busy = False
+
     def __init__(self):
         LOGIC_OBJECTS.append(self)
 
@@ -87,7 +173,12 @@ class Notifier:
             listener = LISTENERS[listener_id]
             if listener is not None:
                 for method in methods:
-                    method(event=event)
+                    if PROFILER is None:
+                        method(event=event)
+                    else:
+                        start = perf_counter()
+                        method(event=event)
+                        PROFILER.add('notify', method.__qualname__, perf_counter() - start)
     def connect(self, event: Event, listener, method):
         if listener.listener_id not in NOTIFIERS[self.notifier_id].keys():
             NOTIFIERS[self.notifier_id][listener.listener_id] = [method]
@@ -126,6 +217,10 @@ class Timer(Notifier, LogicObject):
         LogicObject.__init__(self)
         Notifier.__init__(self)
 
+    @property
+    def busy(self):
+        return self.can_tick
+
     def reset(self):
         self.can_tick = True
         self.finished = False
@@ -148,26 +243,95 @@ class Timer(Notifier, LogicObject):
                 self.notify(Event("timeout"))
 
 
-class Key(LogicObject):
-    """Describes state of key"""
+class InputState:
+    """Keyboard state of a frame as bitmasks, one bit per bound key. See INPUT.
 
-    def __init__(self, key_id: int, input_mode="human"):
-        self.key_id = key_id
-        self.pressed = False
-        self.just_pressed = False
-        self.input_mode = input_mode
-        LogicObject.__init__(self)
+    Fed with key events, so a frame costs the same however many keys are bound. Keys get their bit on first
+    bind. With auto repeat (das and arr in seconds), repeated has the bits of the keys pressed this frame or
+    whose repeat is due, like a held key in the official games. Without it, repeated is pressed."""
 
-    def update(self, dt: float):
-        if self.input_mode == "agent":
-            key_status = AGENT_KEYS[self.key_id]
-        elif self.input_mode == "human":
-            key_status = KEYS[self.key_id]
-        if key_status:
-            if not self.pressed:
-                self.just_pressed = True
-            else:
-                self.just_pressed = False
-            self.pressed = True
+    def __init__(self, das=None, arr=None):
+        self.key_bits = {}
+        self.pressed = 0
+        self.just_pressed = 0
+        self.repeated = 0
+        self.das = das
+        self.arr = arr
+        # Bit -> time of the next repeat, for the held keys
+        self.repeat_times = {}
+
+    @property
+    def auto_repeat(self):
+        return self.das is not None
+
+    def bind(self, key_id):
+        """Bit of a key, allocated on first use"""
+        bit = self.key_bits.get(key_id)
+        if bit is None:
+            bit = self.key_bits[key_id] = 1 << len(self.key_bits)
+        return bit
+
+    def begin_frame(self):
+        self.just_pressed = 0
+
+    def key_down(self, key_id, now):
+        bit = self.key_bits.get(key_id)
+        if bit is not None:
+            self.pressed |= bit
+            self.just_pressed |= bit
+            if self.auto_repeat:
+                self.repeat_times[bit] = now + self.das
+
+    def key_up(self, key_id):
+        bit = self.key_bits.get(key_id)
+        if bit is not None:
+            self.pressed &= ~bit
+            self.repeat_times.pop(bit, None)
+
+    def end_frame(self, now):
+        if not self.auto_repeat:
+            self.repeated = self.pressed
+            return
+        self.repeated = self.just_pressed
+        for bit, time in self.repeat_times.items():
+            if time <= now:
+                self.repeated |= bit
+                # Repeats that were due in the meantime are merged, at most one per frame
+                self.repeat_times[bit] = max(time + self.arr, now) if self.arr > 0 else now
+
+    def release_all(self):
+        self.pressed = 0
+        self.just_pressed = 0
+        self.repeated = 0
+        self.repeat_times.clear()
+
+
+class KeyQueue(LogicObject):
+    """Agent key presses, one per frame. See AGENT_KEY_QUEUE"""
+
+    def __init__(self):
+        super().__init__()
+        self.queue = deque()
+        self.max_size = 100
+        self.current_key = None
+
+    @property
+    def busy(self):
+        return bool(self.queue)
+
+    def update(self, dt):
+        if self.queue:
+            self.current_key = self.queue.popleft()
         else:
-            self.pressed = False
+            self.current_key = None
+
+    def add_key(self, key):
+        if len(self.queue) < self.max_size:
+            self.queue.append(key)
+
+    def add_keys(self, keys):
+        for key in keys:
+            self.add_key(key)
+
+    def get_key(self):
+        return self.current_key
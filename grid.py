@@ -3,7 +3,8 @@ import pygame as pg
 
 import commons
 import gameengine
-from gameengine import CanvasObject, Listener, Timer, LogicObject, Event, Notifier
+import kernels
+from gameengine import CanvasObject, Listener, Timer, LogicObject, Event, Notifier, InputState
 
 
 def piece_color(piece_type: int, theme):
@@ -34,6 +35,7 @@ def piece_color(piece_type: int, theme):
 class Rotation:
     """ Rotation class for tetrominoes.
      Rotation is stored as an integer from 0 to 3, where 0 is the default rotation."""
+    __slots__ = ('__val',)
 
     def __init__(self, value):
         self.__val = value
@@ -54,6 +56,32 @@ class Rotation:
         self.__val = (self.__val - 1) % 4
 
 
+# Shared rotations, used where a Rotation is only read. Never mutate them
+ROTATIONS = tuple(Rotation(value) for value in range(4))
+
+# PlayField actions of a tick, decoded once into a bitmask. Moves repeat while held, the others act on press
+ACTION_LEFT = 1 << 0
+ACTION_RIGHT = 1 << 1
+ACTION_SOFT_DROP = 1 << 2
+ACTION_DAS_LEFT = 1 << 3
+ACTION_DAS_RIGHT = 1 << 4
+ACTION_CLOCKWISE = 1 << 5
+ACTION_COUNTER_CLOCKWISE = 1 << 6
+ACTION_180 = 1 << 7
+ACTION_HARD_DROP = 1 << 8
+ACTION_SWITCH = 1 << 9
+ACTION_PAUSE = 1 << 10
+ACTION_RESTART = 1 << 11
+MOVE_ACTIONS = ACTION_LEFT | ACTION_RIGHT | ACTION_SOFT_DROP | ACTION_DAS_LEFT | ACTION_DAS_RIGHT
+ROTATE_ACTIONS = ACTION_CLOCKWISE | ACTION_COUNTER_CLOCKWISE | ACTION_180
+HELD_ACTIONS = ACTION_LEFT | ACTION_RIGHT | ACTION_SOFT_DROP
+# Action names of the key maps and the agent keys, see gameengine.AGENT_KEY_QUEUE
+AGENT_ACTIONS = {'left': ACTION_LEFT, 'right': ACTION_RIGHT, 'soft_drop': ACTION_SOFT_DROP,
+                 'das_left': ACTION_DAS_LEFT, 'das_right': ACTION_DAS_RIGHT, 'clockwise': ACTION_CLOCKWISE,
+                 'counter_clockwise': ACTION_COUNTER_CLOCKWISE, '180': ACTION_180, 'hard_drop': ACTION_HARD_DROP,
+                 'switch': ACTION_SWITCH, 'pause': ACTION_PAUSE, 'restart': ACTION_RESTART}
+
+
 def piece_cfg(piece_type, rotation):
     """Returns the configuration of a piece based on its type and rotation.
 
@@ -136,11 +164,73 @@ def piece_cfg(piece_type, rotation):
     return cfg
 
 
+PIECE_TYPES = (73, 74, 76, 79, 83, 84, 90)
+
+
+def piece_cells(piece_type, rotation: int):
+    """Returns the (dx, dy) offsets of the blocks of a piece, relative to its position."""
+    cfg = piece_cfg(piece_type, Rotation(rotation))
+    return tuple((3 - i % 4, i // 4) for i in range(16) if (cfg >> i) & 1)
+
+
+def piece_bottoms(piece_type, rotation: int):
+    """Returns the lowest block (dx, dy) of every column a piece occupies."""
+    bottoms = {}
+    for dx, dy in piece_cells(piece_type, rotation):
+        if dx not in bottoms or dy < bottoms[dx]:
+            bottoms[dx] = dy
+    return tuple(sorted(bottoms.items()))
+
+
+# Lookup tables by piece type, then rotation
+PIECE_CELLS = {piece_type: tuple(piece_cells(piece_type, r) for r in range(4)) for piece_type in PIECE_TYPES}
+PIECE_BOTTOMS = {piece_type: tuple(piece_bottoms(piece_type, r) for r in range(4)) for piece_type in PIECE_TYPES}
+
+# Offsets tried in order when rotating: in place, wall kick left, wall kick right, experimental floor kick
+ROTATION_KICKS = ((0, 0), (-1, 0), (1, 0), (0, 1))
+
+# The same tables as arrays, for the kernels
+PIECE_CELL_ARRAYS = {piece_type: np.array(cells, dtype=np.int64) for piece_type, cells in PIECE_CELLS.items()}
+ROTATION_KICK_ARRAY = np.array(ROTATION_KICKS, dtype=np.int64)
+
+# Default agent rewards of PlayField, see agent_score_scheme
+AGENT_SCORE_SCHEME = {'move_delta_score': 1, 'game_over_delta_score': -1000, 'non_line_clear_delta_score': 8}
+
+
+def clear_full_rows(cells):
+    """Remove all full rows in-place and let the rows above fall down in a single compaction.
+
+    Works on a single board of shape (rows, cols) or a batch of shape (boards, rows, cols).
+    Returns the cleared row indices (cells order, top row first). For a batch, the result is
+    a (board_indices, row_indices) tuple, as returned by np.nonzero."""
+    if cells.ndim == 2 and kernels.ENABLED:
+        return kernels.clear_full_rows(cells)
+    full = cells.all(axis=-1)
+    if cells.ndim == 2:
+        cleared = np.flatnonzero(full)
+        n = len(cleared)
+        if n != 0:
+            # Surviving rows keep their order and sink to the bottom, the freed rows on top are emptied
+            cells[n:] = cells[~full]
+            cells[:n] = 0
+        return cleared
+    cleared = np.nonzero(full)
+    if len(cleared[0]) != 0:
+        # Stable sort puts the full rows first and keeps the order of the surviving rows
+        order = np.argsort(~full, axis=1, kind='stable')
+        cells[:] = np.take_along_axis(cells, order[:, :, np.newaxis], axis=1)
+        counts = full.sum(axis=1)
+        cells[np.arange(cells.shape[1])[np.newaxis, :] < counts[:, np.newaxis]] = 0
+    return cleared
+
+
 class Grid:
     def __init__(self, cols, rows, dtype=np.int8):
         self.cols = cols
         self.rows = rows
         self.cells = np.zeros((rows, cols), dtype=dtype)
+        # Height of every column, one above its highest block. Maintained by raise_surface and clear_full_rows
+        self.surface = np.zeros(cols, dtype=np.int16)
 
     def set(self, x, y, value):
         """Set value to specified cell. Unsafe, no bound-checking."""
@@ -159,6 +249,25 @@ class Grid:
     def reset(self):
         """Reset grid to all zeros."""
         self.cells = np.zeros((self.rows, self.cols), dtype=self.cells.dtype)
+        self.surface[:] = 0
+
+    def raise_surface(self, x, y):
+        """Account for a block written at the specified cell in the column surface. Unsafe, no bound-checking."""
+        if self.surface[x] <= y:
+            self.surface[x] = y + 1
+
+    def clear_full_rows(self):
+        """Clear all full rows and return their row indices."""
+        cleared = clear_full_rows(self.cells)
+        if len(cleared) != 0:
+            # The top block of a column can be in a cleared row, with holes under it, so rescan the surface
+            self.update_surface()
+        return cleared
+
+    def update_surface(self):
+        """Recompute the column surface from the cells."""
+        filled = self.cells != 0
+        self.surface[:] = np.where(filled.any(axis=0), self.rows - filled.argmax(axis=0), 0)
 
 
 class DisplayGrid(Grid, CanvasObject):
@@ -173,9 +282,12 @@ class DisplayGrid(Grid, CanvasObject):
                               height=rows * (cell_size + cell_margin) + cell_margin)
         if transparent_mode:
             self.image.set_colorkey(theme['palette']['empty'])
+        # Cells the image shows, it is only redrawn when they change
+        self.drawn_cells = None
 
     def set_theme(self, theme):
         self.theme = theme
+        self.drawn_cells = None
 
     def show_piece(self, piece_type, rotation: Rotation, x, y, color_override=None):
         """Write a tetronimo to the grid. Unsafe, no bound-checking."""
@@ -192,15 +304,43 @@ class DisplayGrid(Grid, CanvasObject):
 
     def can_show_piece(self, piece_type, rotation: Rotation, x, y):
         """Check if a tetronimo can be written to the grid. Safe."""
-        cfg = piece_cfg(piece_type, rotation)
-        for i in range(16):
-            if (cfg >> i) & 1:
-                if self.get_safe(x + 3 - i % 4, y + i // 4) != 0:
-                    return False
+        if kernels.ENABLED:
+            return kernels.fits(self.cells, PIECE_CELL_ARRAYS[piece_type][rotation.get()], x, y)
+        for dx, dy in PIECE_CELLS[piece_type][rotation.get()]:
+            if self.get_safe(x + dx, y + dy) != 0:
+                return False
 
         return True
 
+    def kick_piece(self, piece_type, rotation: Rotation, x, y):
+        """Find where a rotated tetronimo fits, trying ROTATION_KICKS in order. Returns the (x, y) or None. Safe."""
+        for dx, dy in ROTATION_KICKS:
+            if self.can_show_piece(piece_type, rotation, x + dx, y + dy):
+                return x + dx, y + dy
+        return None
+
+    def landing_y(self, piece_type, rotation: Rotation, x, y):
+        """Get the lowest y a tetronimo can fall to from the specified position. The position must be valid.
+
+        Uses the column surfaces, so it only falls back to scanning down when the piece is under an overhang."""
+        landing = None
+        for dx, dy in PIECE_BOTTOMS[piece_type][rotation.get()]:
+            surface = self.surface[x + dx]
+            if y + dy < surface:
+                # Tucked under an overhang, the surface says nothing about what is below
+                if kernels.ENABLED:
+                    return int(kernels.drop_y(self.cells, PIECE_CELL_ARRAYS[piece_type][rotation.get()], x, y))
+                while self.can_show_piece(piece_type, rotation, x, y - 1):
+                    y -= 1
+                return y
+            if landing is None or surface - dy > landing:
+                landing = surface - dy
+        return int(landing)
+
     def draw(self):
+        if self.drawn_cells is not None and np.array_equal(self.drawn_cells, self.cells):
+            return
+        self.drawn_cells = self.cells.copy()
         for y in range(self.rows):
             for x in range(self.cols):
                 piece_type = self.get(x, y)
@@ -228,16 +368,15 @@ class DisplayGrid(Grid, CanvasObject):
 
 
 class PlayField(Notifier, Listener, LogicObject):
-    def __init__(self, x, y, block_size, block_margin, theme, key_map=commons.key_binds,
+    def __init__(self, x, y, block_size, block_margin, theme, key_map=None,
                  play_field_offset: tuple = (0, 0), hold_field_offset: tuple = (0, 0),
                  next_field_offset: tuple = (0, 0),
                  environment: Listener = None,
                  # Score schemes. When designing, these should scale with the official tetris score guideline.
                  # See https://tetris.wiki/Scoring. (also see set_score())
                  # Positive values encourage the model to explore the action space.
-                 agent_score_scheme: dir = {'move_delta_score': 1, 'game_over_delta_score': -1000,
-                                            'non_line_clear_delta_score': 8},
-                 agent_mode=False):
+                 agent_score_scheme: dir = AGENT_SCORE_SCHEME,
+                 agent_mode=False, seed=None):
         LogicObject.__init__(self)
         Listener.__init__(self)
         Notifier.__init__(self)
@@ -259,6 +398,8 @@ class PlayField(Notifier, Listener, LogicObject):
         self.hold_field.draw_level = 3
 
         self.bag = []
+        # Bag randomizer, seed it for reproducible piece sequences
+        self.rng = np.random.default_rng(seed)
         self.max_next_pieces = 5
         next_fields_margin = 0
         self.next_fields = [DisplayGrid(x + next_field_offset[0],
@@ -277,17 +418,23 @@ class PlayField(Notifier, Listener, LogicObject):
         self.fast_move_timer = Timer(0.01)
         self.delta_points_render_timer = Timer(2, auto_start=False)
 
-        # Used keys
-        self.k_clockwise = key_map['clockwise']
-        self.k_counter_clockwise = key_map['counter_clockwise']
-        self.k_switch = key_map['switch']
-        self.k_hard_drop = key_map['hard_drop']
-        self.k_soft_drop = key_map['soft_drop']
-        self.k_left = key_map['left']
-        self.k_right = key_map['right']
-        self.k_180 = key_map['180']
-        self.k_restart = key_map['restart']
-        self.k_pause = key_map['pause']
+        # Used keys, bound to bits of gameengine.INPUT
+        if key_map is None:
+            key_map = commons.get_key_binds()
+        if gameengine.INPUT is None:
+            gameengine.INPUT = InputState()
+        self.key_actions = {}
+        # Keys acting while held, and on press
+        self.held_key_mask = 0
+        self.press_key_mask = 0
+        for name, key_id in key_map.items():
+            bit = gameengine.INPUT.bind(key_id)
+            action = AGENT_ACTIONS[name]
+            self.key_actions[bit] = self.key_actions.get(bit, 0) | action
+            if action & HELD_ACTIONS:
+                self.held_key_mask |= bit
+            else:
+                self.press_key_mask |= bit
 
         # Game flags
         self.game_started = False
@@ -310,20 +457,32 @@ class PlayField(Notifier, Listener, LogicObject):
         self.score = 0
         # Last score change, used by Reinforcement Learning agents
         self.last_delta_score = 0
+        # Agent reward of the last locked piece, kept after the next piece spawns
+        self.last_lock_reward = 0
         # Score gained for any move
         self.move_delta_score = agent_score_scheme['move_delta_score']
         # Game lost score
         self.game_over_delta_score = agent_score_scheme['game_over_delta_score']
         self.non_line_clear_delta_score = agent_score_scheme['non_line_clear_delta_score']
         self.level = 1
+        # Game totals
+        self.total_lines = 0
+        self.pieces_placed = 0
+        self.tetrises = 0
+        # Locked pieces of the current game as (piece_type, x, y, rotation), used for replays
+        self.history = []
         self.last_move_name = None
         self.last_clear_name = None
         self.last_action = None
+        # Row indices removed by the last lock, used by scoring and animations
+        self.last_cleared_rows = np.empty(0, dtype=np.intp)
         self.agent_mode = agent_mode
+        # Whether this tick's actions came from the agent, see read_actions
+        self.agent_action = False
 
         # Pieces
         self.current_piece_type = None
-        self.current_piece_rotation = Rotation(0)
+        self.current_piece_rotation = ROTATIONS[0]
         self.current_piece_x = 0
         self.current_piece_y = 0
         self.hold_piece_type = None
@@ -344,21 +503,10 @@ class PlayField(Notifier, Listener, LogicObject):
         self.start_game()
 
     # Field logic
-    def clean_row(self, row):
-        """Remove a row from the grid and move all rows above it down."""
-        self.game_field.cells[row, :] = 0
-        # Shift all rows above down
-        self.game_field.cells[:row + 1, :] = np.roll(self.game_field.cells[:row + 1, :], 1, axis=0)
-
     def clean_rows(self):
-        """Clean all full rows and return the number of rows cleaned."""
-        cleaned_rows = 0
-        for row in range(self.rows):
-            # Are all pieces non-zero?
-            if np.all(self.game_field.cells[row, :]):
-                self.clean_row(row)
-                cleaned_rows += 1
-        return cleaned_rows
+        """Clean all full rows and return their row indices (cells order, top row first)."""
+        self.last_cleared_rows = self.game_field.clear_full_rows()
+        return self.last_cleared_rows
 
     # Piece bag
     def pop_bag(self, enable_switch=True):
@@ -368,7 +516,7 @@ class PlayField(Notifier, Listener, LogicObject):
         # If there are not enough pieces to show, extend the bag
         if len(self.bag) <= self.max_next_pieces + 1:
             batch = ["I", "I", "J", "J", "L", "L", "O", "O", "S", "S", "T", "T", "Z", "Z"]
-            np.random.shuffle(batch)
+            self.rng.shuffle(batch)
             batch = [ord(c) for c in batch]
             self.bag.extend(batch)
         self.populate_next_field()
@@ -383,9 +531,12 @@ class PlayField(Notifier, Listener, LogicObject):
 
     # Piece and score logic
     def lock_piece(self):
+        gameengine.invalidate()
         cfg = piece_cfg(self.current_piece_type, self.current_piece_rotation)
         # Lock out flag. If it's above the vanish zone in its entirety (y = 20), it's game over
         lock_out = True
+        self.history.append((self.current_piece_type, self.current_piece_x, self.current_piece_y,
+                             self.current_piece_rotation.get()))
         for i in range(16):
             if (cfg >> i) & 1:
                 x = self.current_piece_x + 3 - i % 4
@@ -393,24 +544,56 @@ class PlayField(Notifier, Listener, LogicObject):
                 if y < 20:
                     lock_out = False
                 self.game_field.set(x, y, self.current_piece_type)
+                self.game_field.raise_surface(x, y)
         if lock_out:
             self.last_delta_score += self.game_over_delta_score
+            self.last_lock_reward = self.last_delta_score
             self.game_over = True
             self.notify(Event("game_over", features=self.fetch_features(0)))
             self.pause()
         else:
-            rows = self.clean_rows()
+            rows = len(self.clean_rows())
+            self.pieces_placed += 1
+            self.total_lines += rows
+            if rows == 4:
+                self.tetrises += 1
 
             if rows != 0:
                 self.last_delta_score += self.set_score(rows, self.current_piece_type)
             else:
                 self.last_delta_score += self.non_line_clear_delta_score
-            self.notify(Event("feature_batch", features=self.fetch_features(rows)))
+            self.last_lock_reward = self.last_delta_score
+            # The next piece from the bag is the one the agent gets to place
+            self.notify(Event("feature_batch", features=self.fetch_features(rows), pending_piece_type=self.bag[0],
+                              spawn_position=self.spawn_position(), field=self))
             self.spawn_piece(piece_type=self.pop_bag())
 
+    def switch_piece(self):
+        """Swap the current piece with the hold piece, or with the next piece if nothing is held"""
+        self.can_switch = False
+        if self.hold_piece_type is None:
+            self.hold_piece_type = self.current_piece_type
+            self.current_piece_type = self.pop_bag(enable_switch=False)
+        else:
+            self.hold_piece_type, self.current_piece_type = self.current_piece_type, self.hold_piece_type
+        self.hold_field.reset_and_show_piece(self.hold_piece_type, Rotation(0), 0, 0)
+        self.spawn_piece(self.current_piece_type)
+
+    def place_piece(self, x, y, rotation: int, hold=False):
+        """Headless play: lock the current piece (or the hold piece) at the given position, e.g. a Placement.
+        The position is trusted, see movegen for reachable ones."""
+        if hold:
+            self.switch_piece()
+        self.current_piece_x = x
+        self.current_piece_y = y
+        self.current_piece_rotation = ROTATIONS[rotation]
+        self.last_move_name = "hard_drop"
+        self.lock_piece()
+
     def on_delta_score_render_timeout(self, event: Event = None):
         self.delta_points_render_timer.pause()
         self.delta_score_panel.invisible = True
+        gameengine.invalidate()
 
     def set_score(self, rows, last_piece_type):
         drop_multiplier = 1
@@ -448,13 +631,12 @@ class PlayField(Notifier, Listener, LogicObject):
 
     def move_piece(self):
         """Wrapper for normal & ghost piece placement"""
-        # Ghost
-        lowest_y = self.current_piece_y
+        gameengine.invalidate()
         # Add up and reset when locking
         self.last_delta_score += self.move_delta_score
-        while self.game_field.can_show_piece(self.current_piece_type, self.current_piece_rotation,
-                                             self.current_piece_x, lowest_y - 1):
-            lowest_y -= 1
+        # Ghost
+        lowest_y = self.game_field.landing_y(self.current_piece_type, self.current_piece_rotation,
+                                             self.current_piece_x, self.current_piece_y)
         self.ghost_field.reset_and_show_piece(self.current_piece_type, self.current_piece_rotation,
                                               self.current_piece_x, lowest_y, color_override=ord('X'))
         # Normal
@@ -470,11 +652,14 @@ class PlayField(Notifier, Listener, LogicObject):
             self.fall_timer.reset()
             self.request_lock()
 
+    def spawn_position(self):
+        """Default spawn (x, y, rotation) of every piece"""
+        return self.cols // 2 - 2, self.rows // 2, 0
+
     def spawn_piece(self, piece_type):
         """Spawn a piece at default spawn position"""
-        self.current_piece_x = self.cols // 2 - 2
-        self.current_piece_y = self.rows // 2
-        self.current_piece_rotation = Rotation(0)
+        self.current_piece_x, self.current_piece_y, rotation = self.spawn_position()
+        self.current_piece_rotation = ROTATIONS[rotation]
         self.current_piece_type = piece_type
         self.last_delta_score = 0
         self.move_piece()
@@ -483,6 +668,11 @@ class PlayField(Notifier, Listener, LogicObject):
         # Init game
         self.score = 0
         self.last_delta_score = 0
+        self.last_lock_reward = 0
+        self.total_lines = 0
+        self.pieces_placed = 0
+        self.tetrises = 0
+        self.history = []
         self.game_started = True
         self.game_over = False
         self.level = 1
@@ -510,9 +700,12 @@ class PlayField(Notifier, Listener, LogicObject):
         self.last_move_name = None
         self.last_clear_name = None
         self.last_action = None
+        self.last_cleared_rows = np.empty(0, dtype=np.intp)
         # Spawn piece
         self.spawn_piece(self.pop_bag())
-        self.notify(Event("feature_batch", features=self.fetch_features(0)))
+        self.notify(Event("feature_batch", features=self.fetch_features(0),
+                          pending_piece_type=self.current_piece_type, spawn_position=self.spawn_position(),
+                          field=self))
 
     def pause(self):
         self.fall_timer.pause()
@@ -557,9 +750,14 @@ class PlayField(Notifier, Listener, LogicObject):
         features['game_field'] = self.game_field
         features['score'] = self.score
         # From game grid, fetch height of each column
-        features['column_heights'] = [self.game_field.get_column_height(i) for i in range(self.cols)]
-        features['column_holes'] = [self.game_field.get_column_holes(i, features['column_heights'][i])
-                                    for i in range(self.cols)]
+        if kernels.ENABLED:
+            heights, holes = kernels.column_features(self.game_field.cells)
+            features['column_heights'] = heights.tolist()
+            features['column_holes'] = holes.tolist()
+        else:
+            features['column_heights'] = [self.game_field.get_column_height(i) for i in range(self.cols)]
+            features['column_holes'] = [self.game_field.get_column_holes(i, features['column_heights'][i])
+                                        for i in range(self.cols)]
         features['total_holes'] = sum(features['column_holes'])
         # A measure of bumpiness (the sum of the absolute differences between adjacent columns)
         features['total_bumpiness'] = sum([abs(features['column_heights'][i] - features['column_heights'][i + 1])
@@ -570,66 +768,81 @@ class PlayField(Notifier, Listener, LogicObject):
         features['hold_piece_type'] = self.hold_piece_type
         features['reward'] = self.last_delta_score
         features['lines_cleared'] = rows_cleared
+        features['total_lines'] = self.total_lines
+        features['pieces_placed'] = self.pieces_placed
         return features
 
+    def read_actions(self):
+        """Bitmask of this tick's actions. agent_action tells whether they came from the agent"""
+        self.agent_action = False
+        actions = 0
+        input_state = gameengine.INPUT
+        keys = (input_state.repeated & self.held_key_mask) | (input_state.just_pressed & self.press_key_mask)
+        # Only the keys down cost anything
+        while keys:
+            bit = keys & -keys
+            actions |= self.key_actions[bit]
+            keys ^= bit
+        if self.agent_mode:
+            agent_key = gameengine.AGENT_KEY_QUEUE.get_key()
+            if agent_key is not None:
+                self.agent_action = True
+                actions |= AGENT_ACTIONS[agent_key]
+        return actions
+
     def update(self, dt: float):
+        actions = self.read_actions()
+        if not actions:
+            # Idle, gravity and lock delay run on their own timers
+            return
         desired_x = self.current_piece_x
         desired_y = self.current_piece_y
-        desired_rotation = Rotation(self.current_piece_rotation.get())
-        move_command = False
-        rotate_command = False
+        desired_rotation = self.current_piece_rotation.get()
+        move_command = actions & MOVE_ACTIONS
+        rotate_command = actions & ROTATE_ACTIONS
         switch_command = False
-        agent_key = None
-        if self.agent_mode:
-            # Get action from agent queue
-            agent_key = gameengine.AGENT_KEY_QUEUE.get_key()
-        if self.agent_mode and agent_key == "soft_drop" or self.k_soft_drop.pressed:
+        das_direction = 0
+        if actions & ACTION_SOFT_DROP:
             desired_y -= 1
-            move_command = True
-        if self.agent_mode and agent_key == "left" or self.k_left.pressed:
+        if actions & ACTION_LEFT:
             desired_x -= 1
-            move_command = True
-        if self.agent_mode and agent_key == "right" or self.k_right.pressed:
+        if actions & ACTION_RIGHT:
             desired_x += 1
-            move_command = True
-        if self.agent_mode and agent_key == "clockwise" or self.k_clockwise.just_pressed:
-            desired_rotation.set_clockwise()
-            rotate_command = True
-        if self.agent_mode and agent_key == "counter_clockwise" or self.k_counter_clockwise.just_pressed:
-            desired_rotation.set_counter_clockwise()
-            rotate_command = True
-        if self.agent_mode and agent_key == "180" or self.k_180.just_pressed:
-            desired_rotation.set_clockwise()
-            desired_rotation.set_clockwise()
-            rotate_command = True
-        if not self.game_paused and (self.agent_mode and agent_key == "hard_drop" or self.k_hard_drop.just_pressed):
-            while self.game_field.can_show_piece(self.current_piece_type, self.current_piece_rotation,
-                                                 self.current_piece_x, self.current_piece_y - 1):
-                self.current_piece_y -= 1
+        # Agent only: shift all the way to the wall, like a fully charged DAS with instant auto repeat
+        if actions & ACTION_DAS_LEFT:
+            das_direction = -1
+        if actions & ACTION_DAS_RIGHT:
+            das_direction = 1
+        if actions & ACTION_CLOCKWISE:
+            desired_rotation += 1
+        if actions & ACTION_COUNTER_CLOCKWISE:
+            desired_rotation -= 1
+        if actions & ACTION_180:
+            desired_rotation += 2
+        desired_rotation = ROTATIONS[desired_rotation % 4]
+        if not self.game_paused and actions & ACTION_HARD_DROP:
+            self.current_piece_y = self.game_field.landing_y(self.current_piece_type, self.current_piece_rotation,
+                                                             self.current_piece_x, self.current_piece_y)
             self.last_move_name = "hard_drop"
             self.lock_piece()
 
-        elif not self.game_paused and (self.agent_mode and agent_key == "switch" or self.k_switch.just_pressed) and self.can_switch:
-            self.can_switch = False
-            if self.hold_piece_type is None:
-                self.hold_piece_type = self.current_piece_type
-                self.current_piece_type = self.pop_bag(enable_switch=False)
-                self.hold_field.reset_and_show_piece(self.hold_piece_type, Rotation(0), 0, 0)
-                self.spawn_piece(self.current_piece_type)
-            else:
-                self.hold_piece_type, self.current_piece_type = self.current_piece_type, self.hold_piece_type
-                self.hold_field.reset_and_show_piece(self.hold_piece_type, Rotation(0), 0, 0)
-                self.spawn_piece(self.current_piece_type)
+        elif not self.game_paused and actions & ACTION_SWITCH and self.can_switch:
+            self.switch_piece()
             switch_command = True
-        if self.agent_mode and agent_key == "pause" or self.k_pause.just_pressed:
+        if actions & ACTION_PAUSE:
             if self.game_paused:
                 self.resume()
             else:
                 self.pause()
-        if self.agent_mode and agent_key == "restart" or self.k_restart.just_pressed:
+        if actions & ACTION_RESTART:
             self.start_game()
         if not self.game_paused and move_command and not switch_command:
-            if self.move_timer.finished:
+            # Agent keys are single presses, the repeat timers only throttle held human keys
+            if self.agent_action or gameengine.INPUT.auto_repeat or self.move_timer.finished:
+                if das_direction != 0:
+                    while self.game_field.can_show_piece(self.current_piece_type, self.current_piece_rotation,
+                                                         desired_x + das_direction, desired_y):
+                        desired_x += das_direction
                 if self.game_field.can_show_piece(self.current_piece_type, self.current_piece_rotation,
                                                   desired_x, desired_y):
                     self.current_piece_x = desired_x
@@ -644,38 +857,17 @@ class PlayField(Notifier, Listener, LogicObject):
                     else:
                         self.lock_requests = 0
         if not self.game_paused and rotate_command and not switch_command:
-            if self.rotation_timer.finished:
+            if self.agent_action or self.rotation_timer.finished:
                 request = False
-                if self.game_field.can_show_piece(self.current_piece_type, desired_rotation,
-                                                  self.current_piece_x, self.current_piece_y):
-                    self.current_piece_rotation = Rotation(desired_rotation.get())
+                # Try in place, then the wall and floor kicks
+                kicked = self.game_field.kick_piece(self.current_piece_type, desired_rotation,
+                                                    self.current_piece_x, self.current_piece_y)
+                if kicked is not None:
+                    self.current_piece_x, self.current_piece_y = kicked
+                    self.current_piece_rotation = desired_rotation
                     self.move_piece()
                     self.rotation_timer.reset()
                     request = True
-                # Try wall kick
-                else:
-                    if self.game_field.can_show_piece(self.current_piece_type, desired_rotation,
-                                                      self.current_piece_x - 1, self.current_piece_y):
-                        self.current_piece_x -= 1
-                        self.current_piece_rotation = Rotation(desired_rotation.get())
-                        self.move_piece()
-                        self.rotation_timer.reset()
-                        request = True
-                    elif self.game_field.can_show_piece(self.current_piece_type, desired_rotation,
-                                                        self.current_piece_x + 1, self.current_piece_y):
-                        self.current_piece_x += 1
-                        self.current_piece_rotation = Rotation(desired_rotation.get())
-                        self.move_piece()
-                        self.rotation_timer.reset()
-                        request = True
-                    # Experimental floor kick
-                    elif self.game_field.can_show_piece(self.current_piece_type, desired_rotation,
-                                                        self.current_piece_x, self.current_piece_y + 1):
-                        self.current_piece_y += 1
-                        self.current_piece_rotation = Rotation(desired_rotation.get())
-                        self.move_piece()
-                        self.rotation_timer.reset()
-                        request = True
                 if request:
                     if not self.ghost_field.can_show_piece(self.current_piece_type, self.current_piece_rotation,
                                                            self.current_piece_x, self.current_piece_y - 1):
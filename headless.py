@@ -0,0 +1,43 @@
+import os
+
+import pygame as pg
+
+import commons
+import grid
+from movegen import MoveGenerator
+
+
+def init():
+    """Initialise the pygame modules a PlayField needs, without opening a window."""
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    if not pg.font.get_init():
+        pg.font.init()
+
+
+def make_field(seed=None, **kwargs):
+    """Create a PlayField for headless play. It is never drawn or updated, pieces go in with place_piece."""
+    init()
+    return grid.PlayField(0, 0, 1, 0, commons.color_theme_default, seed=seed, **kwargs)
+
+
+def episode_stats(field: grid.PlayField):
+    return {'score': field.score,
+            'lines': field.total_lines,
+            'pieces': field.pieces_placed,
+            'tetrises': field.tetrises}
+
+
+def run_episode(field: grid.PlayField, policy, generator: MoveGenerator = None, max_pieces=None):
+    """Play one game with a policy, from the current state of the field, and return its statistics.
+
+    The game ends on a lock out, when the spawned piece has no placement or after max_pieces."""
+    generator = generator if generator is not None else MoveGenerator()
+    while not field.game_over and (max_pieces is None or field.pieces_placed < max_pieces):
+        placements = generator.field_placements(field)
+        if not placements:
+            # Blocked at spawn
+            field.game_over = True
+            break
+        placement = policy.choose(field, placements)
+        field.place_piece(placement.x, placement.y, placement.rotation)
+    return episode_stats(field)
@@ -0,0 +1,188 @@
+"""Optional Numba kernels for the board inner loops.
+
+When numba is installed, the kernels are compiled on first use and grid and movegen call them while ENABLED.
+Without numba, or with TETRAI_JIT=0, ENABLED is False and they keep their pure Python/NumPy code. The kernels
+are plain Python too, so they also run (slowly) uncompiled, and test_kernels.py compares them with the Python
+code either way.
+
+Boards are int8 arrays in cells order (top row first), the block of a piece cell (dx, dy) at (x, y) is at
+board[rows - y - dy - 1, x + dx]. Piece cells are int64 arrays of shape (4 rotations, 4 blocks, 2)."""
+import os
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+COMPILED = numba is not None and os.environ.get('TETRAI_JIT', '1') != '0'
+# Whether grid and movegen use the kernels, can be switched off at runtime
+ENABLED = COMPILED
+
+
+def _jit(function):
+    if not COMPILED:
+        return function
+    return numba.njit(cache=True, nogil=True)(function)
+
+
+@_jit
+def fits(board, cells, x, y):
+    """Whether piece cells of one rotation fit the board at (x, y), inside the walls and floor."""
+    rows, cols = board.shape
+    for i in range(cells.shape[0]):
+        cx = x + cells[i, 0]
+        cy = y + cells[i, 1]
+        if cx < 0 or cx >= cols or cy < 0 or cy >= rows or board[rows - cy - 1, cx] != 0:
+            return False
+    return True
+
+
+@_jit
+def drop_y(board, cells, x, y):
+    """Lowest y the piece falls to from a valid position, scanning down."""
+    while fits(board, cells, x, y - 1):
+        y -= 1
+    return y
+
+
+@_jit
+def clear_full_rows(board):
+    """Remove the full rows in-place, the rows above fall down. Returns the cleared row indices."""
+    rows, cols = board.shape
+    full = np.zeros(rows, dtype=np.bool_)
+    count = 0
+    for row in range(rows):
+        filled = True
+        for col in range(cols):
+            if board[row, col] == 0:
+                filled = False
+                break
+        if filled:
+            full[row] = True
+            count += 1
+    cleared = np.empty(count, dtype=np.int64)
+    if count == 0:
+        return cleared
+    write = rows - 1
+    for row in range(rows - 1, -1, -1):
+        if not full[row]:
+            if write != row:
+                board[write, :] = board[row, :]
+            write -= 1
+    board[:count, :] = 0
+    i = 0
+    for row in range(rows):
+        if full[row]:
+            cleared[i] = row
+            i += 1
+    return cleared
+
+
+@_jit
+def column_features(board):
+    """Height and holes of every column, like DisplayGrid.get_column_height and get_column_holes.
+
+    The height is the y of the highest block, the bottom row not counted."""
+    rows, cols = board.shape
+    heights = np.zeros(cols, dtype=np.int64)
+    holes = np.zeros(cols, dtype=np.int64)
+    for col in range(cols):
+        for y in range(rows - 1, 0, -1):
+            if board[rows - y - 1, col] != 0:
+                heights[col] = y
+                break
+        for y in range(heights[col]):
+            if board[rows - y - 1, col] == 0:
+                holes[col] += 1
+    return heights, holes
+
+
+@_jit
+def search_states(board, piece_cells, kicks, moves, x, y, rotation, margin):
+    """Breadth-first search of movegen.search_placements over (x, y, rotation) states.
+
+    moves rows are (dx, dy, rotation offset, repeat until blocked). States are numbered
+    ((rotation * width) + x + margin) * height + y + margin, width and height being the board's plus 2 margins.
+    Returns (states, landing ys) of the distinct resting footprints in the order they are found, and the
+    parent state and move index of every state (-1 if unreached, the start is its own parent)."""
+    rows, cols = board.shape
+    width = cols + 2 * margin
+    height = rows + 2 * margin
+    count = 4 * width * height
+    parents = np.full(count, -1, dtype=np.int64)
+    parent_moves = np.full(count, -1, dtype=np.int64)
+    queue = np.empty(count, dtype=np.int64)
+    found_states = np.empty(count, dtype=np.int64)
+    found_land = np.empty(count, dtype=np.int64)
+    found_keys = np.empty(count, dtype=np.int64)
+    found = 0
+    if not fits(board, piece_cells[rotation], x, y):
+        return found_states[:0], found_land[:0], parents, parent_moves
+    start = ((rotation * width) + x + margin) * height + y + margin
+    parents[start] = start
+    queue[0] = start
+    head = 0
+    tail = 1
+    footprint = np.empty(piece_cells.shape[1], dtype=np.int64)
+    while head < tail:
+        state = queue[head]
+        head += 1
+        sr = state // (width * height)
+        sx = (state // height) % width - margin
+        sy = state % height - margin
+        cells = piece_cells[sr]
+
+        # Hard drop from here, footprints are keyed by their sorted block indices
+        land_y = drop_y(board, cells, sx, sy)
+        for i in range(cells.shape[0]):
+            footprint[i] = (land_y + cells[i, 1]) * cols + sx + cells[i, 0]
+        footprint.sort()
+        key = 0
+        for i in range(footprint.shape[0]):
+            key = key * (rows * cols) + footprint[i]
+        new = True
+        for i in range(found):
+            if found_keys[i] == key:
+                new = False
+                break
+        if new:
+            found_states[found] = state
+            found_land[found] = land_y
+            found_keys[found] = key
+            found += 1
+
+        for move in range(moves.shape[0]):
+            dx, dy, dr, repeat = moves[move, 0], moves[move, 1], moves[move, 2], moves[move, 3]
+            if dr == 0:
+                tx = sx + dx
+                ty = sy + dy
+                if not fits(board, cells, tx, ty):
+                    continue
+                if repeat:
+                    while fits(board, cells, tx + dx, ty + dy):
+                        tx += dx
+                        ty += dy
+                tr = sr
+            else:
+                tr = (sr + dr) % 4
+                kicked = False
+                tx = sx
+                ty = sy
+                for k in range(kicks.shape[0]):
+                    if fits(board, piece_cells[tr], sx + kicks[k, 0], sy + kicks[k, 1]):
+                        tx = sx + kicks[k, 0]
+                        ty = sy + kicks[k, 1]
+                        kicked = True
+                        break
+                if not kicked:
+                    continue
+            target = ((tr * width) + tx + margin) * height + ty + margin
+            if parents[target] != -1:
+                continue
+            parents[target] = state
+            parent_moves[target] = move
+            queue[tail] = target
+            tail += 1
+    return found_states[:found], found_land[:found], parents, parent_moves
@@ -0,0 +1,134 @@
+import csv
+import json
+import os
+import queue
+import threading
+
+
+class MetricsWriter:
+    """Appends metric records to a JSONL or CSV file (by extension) from a background thread.
+
+    log never blocks: when the writer falls behind by more than max_pending records, new records are
+    dropped and counted in dropped. Records that fail to be written are counted in failed, the last error is
+    kept in error and reported by close."""
+
+    def __init__(self, path, max_pending=10000, flush_interval=1.0):
+        self.path = path
+        self.csv_mode = path.endswith('.csv')
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self.failed = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.thread = threading.Thread(target=self.run, name=f'metrics-{os.path.basename(path)}', daemon=True)
+        self.thread.start()
+
+    def log(self, **values):
+        try:
+            self.queue.put_nowait(values)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        """Write the pending records and stop the thread."""
+        while self.thread.is_alive():
+            try:
+                self.queue.put(None, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+        self.thread.join()
+        if self.error is not None:
+            print(f'... metrics {self.path} failed: {self.error!r}, {self.failed} records not written, '
+                  f'{self.dropped} dropped ...')
+
+    def csv_header(self):
+        """Columns of an existing CSV file, so appending keeps them."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return None
+        with open(self.path, newline='') as file:
+            return next(csv.reader(file), None)
+
+    def run(self):
+        try:
+            self.write_records()
+        except Exception as error:
+            # The file can't be written at all, the records are lost
+            self.error = error
+
+    def write_records(self):
+        with open(self.path, 'a', newline='') as file:
+            writer = None
+            if self.csv_mode:
+                header = self.csv_header()
+                if header is not None:
+                    writer = csv.DictWriter(file, header, extrasaction='ignore')
+            while True:
+                try:
+                    record = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    file.flush()
+                    continue
+                if record is None:
+                    break
+                try:
+                    if not self.csv_mode:
+                        file.write(json.dumps(record) + '\n')
+                        continue
+                    if writer is None:
+                        writer = csv.DictWriter(file, list(record), extrasaction='ignore')
+                        writer.writeheader()
+                    writer.writerow(record)
+                except Exception as error:
+                    self.error = error
+                    self.failed += 1
+
+
+def read(path):
+    """Records of a metrics file, as dicts. CSV values are converted to numbers when possible."""
+    if not path.endswith('.csv'):
+        with open(path) as file:
+            return [json.loads(line) for line in file if line.strip()]
+    records = []
+    with open(path, newline='') as file:
+        for row in csv.DictReader(file):
+            for key, value in row.items():
+                try:
+                    row[key] = float(value)
+                except (TypeError, ValueError):
+                    pass
+            records.append(row)
+    return records
+
+
+def plot(paths, x, ys, output=None, smoothing=1):
+    """Plot metric columns of one or more files against x. Shows a window unless output is given."""
+    import matplotlib
+    if output is not None:
+        matplotlib.use('Agg')
+    from matplotlib import pyplot as plt
+    import numpy as np
+
+    fig, axes = plt.subplots(len(ys), 1, sharex=True, squeeze=False, figsize=(8, 3 * len(ys)))
+    for path in paths:
+        records = read(path)
+        for ax, y in zip(axes[:, 0], ys):
+            points = [(record[x], record[y]) for record in records if x in record and y in record]
+            if not points:
+                continue
+            xs, values = np.array(points, dtype=np.float64).T
+            if smoothing > 1 and len(values) >= smoothing:
+                values = np.convolve(values, np.ones(smoothing) / smoothing, mode='valid')
+                xs = xs[smoothing - 1:]
+            ax.plot(xs, values, label=os.path.basename(path))
+            ax.set_ylabel(y)
+    axes[-1, 0].set_xlabel(x)
+    axes[0, 0].legend()
+    fig.tight_layout()
+    if output is not None:
+        fig.savefig(output)
+    else:
+        plt.show()
@@ -0,0 +1,221 @@
+from collections import OrderedDict, deque
+
+import numpy as np
+
+import kernels
+from grid import PIECE_CELLS, PIECE_CELL_ARRAYS, ROTATION_KICK_ARRAY, ROTATION_KICKS, Rotation
+
+# Inputs explored by the search: key name, x offset, y offset, rotation offset, repeat until blocked.
+# Rotations go through ROTATION_KICKS, exactly like PlayField.update
+MOVES = (("left", -1, 0, 0, False),
+         ("right", 1, 0, 0, False),
+         ("das_left", -1, 0, 0, True),
+         ("das_right", 1, 0, 0, True),
+         ("soft_drop", 0, -1, 0, False),
+         ("clockwise", 0, 0, 1, False),
+         ("counter_clockwise", 0, 0, 3, False),
+         ("180", 0, 0, 2, False))
+
+
+class Placement:
+    """Resting state of a piece, with the shortest key sequence reaching it (ends with a hard drop)."""
+    __slots__ = ('piece_type', 'x', 'y', 'rotation', 'path')
+
+    def __init__(self, piece_type, x, y, rotation, path):
+        self.piece_type = piece_type
+        self.x = x
+        self.y = y
+        self.rotation = rotation
+        self.path = path
+
+    def cells(self):
+        """Absolute (x, y) of the blocks of the placed piece."""
+        return tuple((self.x + dx, self.y + dy) for dx, dy in PIECE_CELLS[self.piece_type][self.rotation])
+
+    def __repr__(self):
+        return f'Placement({chr(self.piece_type)}, x={self.x}, y={self.y}, rotation={self.rotation}, ' \
+               f'path={self.path})'
+
+
+def _fits(board, rows, cols, cells, x, y):
+    """Collision check on a nested list of occupied flags, in cells order (top row first)."""
+    for dx, dy in cells:
+        cx = x + dx
+        cy = y + dy
+        if cx < 0 or cx >= cols or cy < 0 or cy >= rows or board[rows - cy - 1][cx]:
+            return False
+    return True
+
+
+# Room around the board for the positions of the pieces' empty 4x4 cells, in kernel state numbers
+KERNEL_MARGIN = 4
+_move_tables = {}
+
+
+def _search_placements_kernel(grid, piece_type, x, y, rotation, moves):
+    """search_placements with kernels.search_states, same results in the same order."""
+    table = _move_tables.get(moves)
+    if table is None:
+        table = _move_tables[moves] = np.array([(dx, dy, dr, repeat) for _, dx, dy, dr, repeat in moves],
+                                               dtype=np.int64)
+    states, land_ys, parents, parent_moves = kernels.search_states(
+        grid.cells, PIECE_CELL_ARRAYS[piece_type], ROTATION_KICK_ARRAY, table, x, y, rotation, KERNEL_MARGIN)
+    height = grid.rows + 2 * KERNEL_MARGIN
+    width = grid.cols + 2 * KERNEL_MARGIN
+    result = []
+    for state, land_y in zip(states.tolist(), land_ys.tolist()):
+        path = ["hard_drop"]
+        node = state
+        while parents[node] != node:
+            path.append(moves[parent_moves[node]][0])
+            node = parents[node]
+        path.reverse()
+        state_rotation, rest = divmod(state, width * height)
+        result.append(Placement(piece_type, rest // height - KERNEL_MARGIN, land_y, state_rotation, tuple(path)))
+    return tuple(result)
+
+
+def search_placements(grid, piece_type, x, y, rotation=0, moves=MOVES):
+    """Breadth-first search over (x, y, rotation) from the given position.
+
+    Returns every distinct resting state reachable by the moves followed by a hard drop, including
+    tucks and spins under overhangs. Placements covering the same cells (symmetric pieces) are merged
+    and keep the shortest path."""
+    if kernels.ENABLED:
+        return _search_placements_kernel(grid, piece_type, x, y, rotation, moves)
+    rows, cols = grid.rows, grid.cols
+    board = (grid.cells != 0).tolist()
+    piece_cells = PIECE_CELLS[piece_type]
+    if not _fits(board, rows, cols, piece_cells[rotation], x, y):
+        return ()
+
+    start = (x, y, rotation)
+    # State -> (previous state, key name)
+    parents = {start: None}
+    frontier = deque([start])
+    placements = {}
+    while frontier:
+        state = frontier.popleft()
+        sx, sy, sr = state
+        cells = piece_cells[sr]
+
+        # Hard drop from here
+        land_y = sy
+        while _fits(board, rows, cols, cells, sx, land_y - 1):
+            land_y -= 1
+        footprint = frozenset((sx + dx, land_y + dy) for dx, dy in cells)
+        if footprint not in placements:
+            placements[footprint] = (state, land_y)
+
+        for key, dx, dy, dr, repeat in moves:
+            if dr == 0:
+                tx, ty = sx + dx, sy + dy
+                if not _fits(board, rows, cols, cells, tx, ty):
+                    continue
+                if repeat:
+                    while _fits(board, rows, cols, cells, tx + dx, ty + dy):
+                        tx += dx
+                        ty += dy
+                target = (tx, ty, sr)
+                if target in parents:
+                    continue
+            else:
+                r = (sr + dr) % 4
+                target = None
+                for kx, ky in ROTATION_KICKS:
+                    if _fits(board, rows, cols, piece_cells[r], sx + kx, sy + ky):
+                        target = (sx + kx, sy + ky, r)
+                        break
+                if target is None or target in parents:
+                    continue
+            parents[target] = (state, key)
+            frontier.append(target)
+
+    result = []
+    for state, land_y in placements.values():
+        path = ["hard_drop"]
+        node = state
+        while parents[node] is not None:
+            node, key = parents[node]
+            path.append(key)
+        path.reverse()
+        result.append(Placement(piece_type, state[0], land_y, state[2], tuple(path)))
+    return tuple(result)
+
+
+class MoveGenerator:
+    """Caches search_placements results by board contents, piece and starting position."""
+
+    def __init__(self, max_cache_size=4096, moves=MOVES):
+        self.max_cache_size = max_cache_size
+        self.moves = moves
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def placements(self, grid, piece_type, x, y, rotation=0):
+        key = (grid.cells.tobytes(), piece_type, x, y, rotation)
+        result = self.cache.get(key)
+        if result is not None:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return result
+        self.misses += 1
+        result = search_placements(grid, piece_type, x, y, rotation, self.moves)
+        self.cache[key] = result
+        if len(self.cache) > self.max_cache_size:
+            self.cache.popitem(last=False)
+        return result
+
+    def field_placements(self, field):
+        """Placements of the current piece of a PlayField, from where it is now."""
+        return self.placements(field.game_field, field.current_piece_type, field.current_piece_x,
+                               field.current_piece_y, field.current_piece_rotation.get())
+
+    def clear(self):
+        self.cache.clear()
+
+
+class InputCompiler:
+    """Turns target placements into the shortest key sequence, one key per frame in agent mode.
+
+    Uses every input PlayField understands: rotations in both directions and 180, DAS shifts to the walls
+    and hold."""
+
+    def __init__(self, generator: MoveGenerator = None):
+        self.generator = generator if generator is not None else MoveGenerator()
+
+    @staticmethod
+    def footprint(grid, piece_type, x, rotation, y=None):
+        """Cells covered by a piece at (x, y, rotation). When y is None, the piece is dropped straight down at x
+        from the top of the grid. Returns None if it doesn't fit."""
+        rot = Rotation(rotation)
+        if y is None:
+            y = grid.rows - 4
+            if not grid.can_show_piece(piece_type, rot, x, y):
+                return None
+            y = grid.landing_y(piece_type, rot, x, y)
+        elif not grid.can_show_piece(piece_type, rot, x, y):
+            return None
+        return frozenset((x + dx, y + dy) for dx, dy in PIECE_CELLS[piece_type][rotation])
+
+    def compile(self, grid, piece_type, start, x, rotation, y=None, hold=False):
+        """Shortest key sequence bringing a piece from start (x, y, rotation) to the target and hard dropping it.
+
+        Set hold when the piece comes out of hold, the sequence then starts with a switch. Returns None if the
+        target can't be reached."""
+        target = self.footprint(grid, piece_type, x, rotation, y)
+        if target is None:
+            return None
+        for placement in self.generator.placements(grid, piece_type, *start):
+            if frozenset(placement.cells()) == target:
+                return (("switch",) if hold else ()) + placement.path
+        return None
+
+    def compile_nearest(self, grid, piece_type, start, x, rotation, hold=False):
+        """Like compile with a straight drop, but falls back to the closest reachable column."""
+        for column in sorted(range(-3, grid.cols), key=lambda c: abs(c - x)):
+            keys = self.compile(grid, piece_type, start, column, rotation, hold=hold)
+            if keys is not None:
+                return keys
+        return None
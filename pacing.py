@@ -0,0 +1,66 @@
+from time import perf_counter
+
+import pygame as pg
+
+import gameengine
+
+
+class FrameScheduler:
+    """Paces the windowed game loop: draws only when the scene changed, sleeps on input when nothing runs.
+
+    Busy frames are capped at fps like before. When no LogicObject is busy (no timer ticks, no agent key waits:
+    paused, game over), the loop blocks on the next input event instead, for at most max_idle seconds. The scene changed when
+    gameengine.SCENE_VERSION did, see gameengine.invalidate."""
+
+    def __init__(self, fps, max_idle=0.25, always_draw=False):
+        self.fps = fps
+        self.max_idle = max_idle
+        # E.g. for the profiler HUD, which changes every frame
+        self.always_draw = always_draw
+        self.clock = pg.time.Clock()
+        self.drawn_version = None
+        self.start = perf_counter()
+        self.frame_start = self.start
+        self.busy_time = 0.0
+        self.idle_time = 0.0
+        self.frames = 0
+        self.drawn_frames = 0
+
+    def begin_frame(self):
+        self.frame_start = perf_counter()
+        return self.frame_start
+
+    def should_draw(self):
+        if not self.always_draw and gameengine.SCENE_VERSION == self.drawn_version:
+            return False
+        self.drawn_version = gameengine.SCENE_VERSION
+        self.drawn_frames += 1
+        return True
+
+    def idle(self):
+        return not any(obj.busy for obj in gameengine.LOGIC_OBJECTS)
+
+    def wait(self):
+        """End the frame and wait for the next one. Returns the delta time of the next frame, in seconds."""
+        now = perf_counter()
+        self.busy_time += now - self.frame_start
+        self.frames += 1
+        if not self.idle():
+            return 0.001 * self.clock.tick(self.fps)
+        event = pg.event.wait(int(self.max_idle * 1000))
+        if event.type != pg.NOEVENT:
+            # Handled by the next frame
+            pg.event.post(event)
+        self.idle_time += perf_counter() - now
+        # Nothing was ticking, so the time spent waiting doesn't count as game time
+        self.clock.tick()
+        return 1 / self.fps
+
+    def duty_cycle(self):
+        """Share of the wall time spent handling input, updating and drawing."""
+        elapsed = perf_counter() - self.start
+        return self.busy_time / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return {'frames': self.frames, 'drawn_frames': self.drawn_frames, 'duty_cycle': self.duty_cycle(),
+                'idle_s': self.idle_time, 'elapsed_s': perf_counter() - self.start}
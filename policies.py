@@ -0,0 +1,92 @@
+import numpy as np
+
+from grid import Grid, clear_full_rows
+from movegen import MoveGenerator
+
+
+def board_features(boards):
+    """Aggregate height, holes, bumpiness and max height of a batch of boards (boards, rows, cols)."""
+    filled = boards != 0
+    rows = boards.shape[1]
+    heights = np.where(filled.any(axis=1), rows - filled.argmax(axis=1), 0)
+    aggregate_height = heights.sum(axis=1)
+    # Every empty cell under the top of its column is a hole
+    holes = aggregate_height - filled.sum(axis=(1, 2))
+    bumpiness = np.abs(np.diff(heights, axis=1)).sum(axis=1)
+    return aggregate_height, holes, bumpiness, heights.max(axis=1)
+
+
+def placement_boards(cells, placements):
+    """Boards after locking each placement and clearing its lines. Returns (boards, lines cleared)."""
+    rows = cells.shape[0]
+    boards = np.repeat(cells[np.newaxis], len(placements), axis=0)
+    for i, placement in enumerate(placements):
+        for x, y in placement.cells():
+            if 0 <= y < rows:
+                boards[i, rows - y - 1, x] = placement.piece_type
+    board_indices, _ = clear_full_rows(boards)
+    return boards, np.bincount(board_indices, minlength=len(placements))
+
+
+class RandomPolicy:
+    """Uniformly random placement."""
+
+    def __init__(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+
+    def choose(self, field, placements):
+        return placements[self.rng.integers(len(placements))]
+
+
+class HeuristicPolicy:
+    """Greedy placement on a weighted sum of board features.
+    Default weights from https://codemyroad.wordpress.com/2013/04/14/tetris-ai-the-near-perfect-player/"""
+
+    def __init__(self, height_weight=-0.510066, lines_weight=0.760666, holes_weight=-0.35663,
+                 bumpiness_weight=-0.184483):
+        self.height_weight = height_weight
+        self.lines_weight = lines_weight
+        self.holes_weight = holes_weight
+        self.bumpiness_weight = bumpiness_weight
+
+    def scores(self, cells, placements):
+        return self.board_scores(*placement_boards(cells, placements))
+
+    def board_scores(self, boards, lines):
+        """Scores of boards after placements, see placement_boards."""
+        height, holes, bumpiness, _ = board_features(boards)
+        return (self.height_weight * height + self.lines_weight * lines + self.holes_weight * holes
+                + self.bumpiness_weight * bumpiness)
+
+    def choose(self, field, placements):
+        return placements[int(np.argmax(self.scores(field.game_field.cells, placements)))]
+
+
+class SearchPolicy(HeuristicPolicy):
+    """Two-ply search on the heuristic: the best placements are scored by the best placement of the next piece
+    after them."""
+
+    def __init__(self, beam_width=8, generator: MoveGenerator = None, **weights):
+        super().__init__(**weights)
+        self.beam_width = beam_width
+        self.generator = generator if generator is not None else MoveGenerator()
+
+    def choose(self, field, placements):
+        boards, lines = placement_boards(field.game_field.cells, placements)
+        first_scores = self.board_scores(boards, lines)
+        spawn_x, spawn_y, spawn_rotation = field.spawn_position()
+        board = Grid(field.cols, field.rows, boards.dtype)
+        best, best_score = 0, -np.inf
+        for i in np.argsort(-first_scores)[:self.beam_width]:
+            board.cells = boards[i]
+            next_placements = self.generator.placements(board, field.bag[0], spawn_x, spawn_y, spawn_rotation)
+            if not next_placements:
+                # Topped out
+                continue
+            score = self.lines_weight * lines[i] + self.scores(boards[i], next_placements).max()
+            if score > best_score:
+                best, best_score = i, score
+        return placements[int(best)]
+
+
+POLICIES = {'random': RandomPolicy, 'heuristic': HeuristicPolicy, 'search': SearchPolicy}
@@ -0,0 +1,106 @@
+import json
+from collections import deque
+
+import numpy as np
+import pygame as pg
+
+import gameengine
+from gameengine import CanvasObject
+
+
+class FrameProfiler:
+    """Opt-in frame profiler. Enable by assigning an instance to gameengine.PROFILER.
+
+    Keeps per-phase frame timings over a sliding window, and cumulative time per class for
+    LogicObject.update, CanvasObject.draw and notifier dispatch."""
+
+    def __init__(self, window=600, percentiles=(50, 90, 99)):
+        self.window = window
+        self.percentiles = percentiles
+        # Phase name -> last frame timings, in seconds
+        self.phases = {}
+        # Category -> {name: [total seconds, calls]}
+        self.totals = {'update': {}, 'draw': {}, 'notify': {}}
+        self.frames = 0
+
+    def record_phase(self, phase, seconds):
+        timings = self.phases.get(phase)
+        if timings is None:
+            timings = self.phases[phase] = deque(maxlen=self.window)
+        timings.append(seconds)
+
+    def record_frame(self, **phases):
+        """Record the timings of one frame, by phase name."""
+        for phase, seconds in phases.items():
+            self.record_phase(phase, seconds)
+        self.record_phase('frame', sum(phases.values()))
+        self.frames += 1
+
+    def add(self, category, name, seconds):
+        """Add time spent in a class or method to its cumulative total."""
+        totals = self.totals[category]
+        entry = totals.get(name)
+        if entry is None:
+            totals[name] = [seconds, 1]
+        else:
+            entry[0] += seconds
+            entry[1] += 1
+
+    def phase_stats(self):
+        """Mean and percentiles of every phase over the window, in milliseconds."""
+        stats = {}
+        for phase, timings in self.phases.items():
+            values = np.fromiter(timings, dtype=np.float64) * 1000
+            stats[phase] = {'mean': float(values.mean())}
+            for p, value in zip(self.percentiles, np.percentile(values, self.percentiles)):
+                stats[phase][f'p{p}'] = float(value)
+        return stats
+
+    def summary(self):
+        return {'frames': self.frames,
+                'window': self.window,
+                'phases_ms': self.phase_stats(),
+                'cumulative_s': {category: {name: {'total': total, 'calls': calls}
+                                            for name, (total, calls) in sorted(totals.items(),
+                                                                               key=lambda item: -item[1][0])}
+                                 for category, totals in self.totals.items()}}
+
+    def export(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.summary(), file, indent=2)
+
+
+class ProfilerHud(CanvasObject):
+    """On-screen overlay with the phase percentiles of a FrameProfiler."""
+
+    def __init__(self, x, y, profiler: FrameProfiler, refresh_frames=30, theme=None):
+        self.profiler = profiler
+        self.refresh_frames = refresh_frames
+        self.color = theme['palette']['text'] if theme is not None else (0, 0, 0)
+        self.font = pg.font.SysFont('Arial', 14)
+        self.last_refresh = -refresh_frames
+        super().__init__(x, y, image=self.font.render('', True, self.color))
+
+    def draw(self):
+        if self.profiler.frames - self.last_refresh < self.refresh_frames or not self.profiler.phases:
+            return
+        self.last_refresh = self.profiler.frames
+        lines = [f'{phase}: ' + ' '.join(f'{key} {value:.2f}' for key, value in stats.items())
+                 for phase, stats in self.profiler.phase_stats().items()]
+        renders = [self.font.render(line, True, self.color) for line in lines]
+        self.image = pg.Surface((max(r.get_width() for r in renders), sum(r.get_height() for r in renders)),
+                                pg.SRCALPHA)
+        offset = 0
+        for render in renders:
+            self.image.blit(render, (0, offset))
+            offset += render.get_height()
+        self.rect = self.image.get_rect().move(self.rect.x, self.rect.y)
+
+
+def enable(window=600, hud=False, position=(5, 5)):
+    """Create a profiler, register it with the engine and optionally show its HUD."""
+    gameengine.PROFILER = FrameProfiler(window)
+    if hud:
+        hud_object = ProfilerHud(position[0], position[1], gameengine.PROFILER)
+        hud_object.draw_level = 10
+    return gameengine.PROFILER
@@ -0,0 +1,75 @@
+"""Binary messages of the environment server. Only depends on numpy, so agents don't need pygame.
+
+Every message is a little-endian uint32 payload length followed by the payload.
+Requests start with a uint8 opcode, replies with a uint8 status (then an error message if not OK).
+
+    INFO       -> uint16 envs, uint16 rows, uint16 cols, uint16 preview
+    RESET      uint16 n, n * (uint16 env, int64 seed, -1 for random) -> n observations
+    STEP       uint16 n, n * (uint16 env, int8 x, int8 y, uint8 rotation) -> n * (float32 reward, uint8 done),
+               then n observations. Each env at most once, placements as listed by PLACEMENTS
+    PLACEMENTS uint16 n, n * uint16 env -> for each env: uint16 count, count * (int8 x, int8 y, uint8 rotation)
+"""
+import socket
+import struct
+
+import numpy as np
+
+INFO = 0
+RESET = 1
+STEP = 2
+PLACEMENTS = 3
+
+OK = 0
+ERROR = 1
+
+LENGTH = struct.Struct('<I')
+INFO_REPLY = struct.Struct('<HHHH')
+COUNT = struct.Struct('<H')
+
+RESET_ITEM = np.dtype([('env', '<u2'), ('seed', '<i8')])
+STEP_ITEM = np.dtype([('env', '<u2'), ('x', 'i1'), ('y', 'i1'), ('rotation', 'u1')])
+STEP_RESULT = np.dtype([('reward', '<f4'), ('done', 'u1')])
+PLACEMENT = np.dtype([('x', 'i1'), ('y', 'i1'), ('rotation', 'u1')])
+ENV_ID = np.dtype('<u2')
+
+
+def observation_dtype(rows=40, cols=10, preview=5):
+    """Packed observation of one game, piece types as ascii (0 for none)."""
+    return np.dtype([('board', 'i1', (rows, cols)),
+                     ('current_piece', 'u1'),
+                     ('hold', 'u1'),
+                     ('preview', 'u1', (preview,)),
+                     ('score', '<i4'),
+                     ('lines', '<i4'),
+                     ('pieces', '<i4'),
+                     ('game_over', 'u1')])
+
+
+def parse_address(address):
+    """unix:<path> or <host>:<port>. Returns (socket family, address)."""
+    if address.startswith('unix:'):
+        return socket.AF_UNIX, address[len('unix:'):]
+    host, port = address.rsplit(':', 1)
+    return socket.AF_INET, (host, int(port))
+
+
+def receive_exactly(connection, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = connection.recv_into(view[received:])
+        if count == 0:
+            raise ConnectionError('connection closed')
+        received += count
+    return buffer
+
+
+def receive_message(connection):
+    length, = LENGTH.unpack(receive_exactly(connection, LENGTH.size))
+    return receive_exactly(connection, length)
+
+
+def send_message(connection, *parts):
+    payload = b''.join(parts)
+    connection.sendall(LENGTH.pack(len(payload)) + payload)
@@ -0,0 +1,252 @@
+import multiprocessing
+import queue
+
+import numpy as np
+
+import commons
+
+# Rows of the board shown, up to the top of the spawned pieces
+VISIBLE_ROWS = 24
+PIECE_TYPE_COLORS = {ord('I'): 'block_cyan', ord('J'): 'block_blue', ord('L'): 'block_orange',
+                     ord('O'): 'block_yellow', ord('S'): 'block_green', ord('T'): 'block_purple',
+                     ord('Z'): 'block_red', ord('X'): 'block_grey', 0: 'empty'}
+
+
+def palette_lut(theme):
+    """Piece type (as uint8) -> RGB lookup table of a theme, to rasterize whole boards at once."""
+    lut = np.zeros((256, 3), dtype=np.uint8)
+    lut[:] = theme['palette']['background']
+    for piece_type, color in PIECE_TYPE_COLORS.items():
+        lut[piece_type] = theme['palette'][color]
+    return lut
+
+
+def rasterize(board, lut, cell_size, cell_margin=0):
+    """RGB pixels of a board in surfarray (x, y) order. board is in cells order, top row first."""
+    pixels = lut[board.view(np.uint8)].transpose(1, 0, 2)
+    pitch = cell_size + cell_margin
+    pixels = np.repeat(np.repeat(pixels, pitch, axis=0), pitch, axis=1)
+    if cell_margin:
+        pixels[pitch - cell_margin::pitch] = lut[255]
+        pixels[:, pitch - cell_margin::pitch] = lut[255]
+    return pixels
+
+
+def snapshot(field):
+    """What a renderer needs of a PlayField: a copy of its visible board with the piece and ghost, and stats."""
+    board = field.game_field.cells[-VISIBLE_ROWS:].copy()
+    moving = field.ghost_field.cells[-VISIBLE_ROWS:]
+    np.copyto(board, moving, where=moving != 0)
+    return {'board': board,
+            'hold': field.hold_piece_type or 0,
+            'preview': list(field.bag[:field.max_next_pieces]),
+            'score': field.score,
+            'lines': field.total_lines,
+            'pieces': field.pieces_placed,
+            'game_over': field.game_over,
+            'paused': field.game_paused}
+
+
+def piece_board(piece_type):
+    """4x4 board of a piece in spawn rotation, for the hold and preview boxes."""
+    from grid import PIECE_CELLS
+
+    board = np.zeros((4, 4), dtype=np.int8)
+    if piece_type:
+        for dx, dy in PIECE_CELLS[piece_type][0]:
+            board[3 - dy, dx] = piece_type
+    return board
+
+
+class BoardView:
+    """Full size view of one game. Updates are snapshots, only the latest is drawn."""
+
+    def __init__(self, theme=commons.color_theme_default, cell_size=24):
+        self.theme = theme
+        self.cell_size = cell_size
+        self.lut = palette_lut(theme)
+        self.latest = None
+        self.font = None
+
+    def size(self):
+        return commons.width, max(commons.height, VISIBLE_ROWS * (self.cell_size + 1) + 1)
+
+    def update(self, snapshot):
+        self.latest = snapshot
+
+    def draw(self, screen):
+        import pygame as pg
+
+        if self.font is None:
+            self.font = pg.font.SysFont('Arial', 20)
+        draw_snapshot(screen, self.font, self.latest, self.lut, self.cell_size, self.theme)
+
+
+class MosaicView:
+    """Thumbnails of many games in one window. Updates are lists of (game index, snapshot).
+
+    The boards are kept in one array and the whole mosaic is rasterized and blitted at once."""
+
+    def __init__(self, games, theme=commons.color_theme_default, cell_size=4, columns=None, rows=VISIBLE_ROWS,
+                 cols=10, label_height=14):
+        self.games = games
+        self.theme = theme
+        self.cell_size = cell_size
+        self.columns = columns if columns is not None else int(np.ceil(np.sqrt(games)))
+        self.lines = -(-games // self.columns)
+        self.lut = palette_lut(theme)
+        # One background column and row between tiles, and rows under each board for its stats
+        self.label_rows = -(-label_height // cell_size)
+        self.boards = np.full((self.lines * self.columns, rows + 1 + self.label_rows, cols + 1), -1, dtype=np.int8)
+        self.board_rows = rows
+        self.board_cols = cols
+        self.stats = [None] * games
+        self.labels = [None] * games
+        self.font = None
+
+    def size(self):
+        return (self.columns * self.boards.shape[2] * self.cell_size,
+                self.lines * self.boards.shape[1] * self.cell_size)
+
+    def update(self, snapshots):
+        for index, snapshot in snapshots:
+            self.boards[index, :self.board_rows, :self.board_cols] = snapshot['board'][-self.board_rows:]
+            stats = (snapshot['score'], snapshot['lines'], snapshot['game_over'])
+            if stats != self.stats[index]:
+                self.stats[index] = stats
+                self.labels[index] = None
+
+    def pixels(self):
+        """RGB pixels of the whole mosaic in surfarray (x, y) order."""
+        _, tile_rows, tile_cols = self.boards.shape
+        tiles = self.boards.reshape(self.lines, self.columns, tile_rows, tile_cols)
+        # (tile column, board column, tile line, board row), x first
+        cells = tiles.transpose(1, 3, 0, 2).reshape(self.columns * tile_cols, self.lines * tile_rows)
+        pixels = self.lut[cells.view(np.uint8)]
+        return np.repeat(np.repeat(pixels, self.cell_size, axis=0), self.cell_size, axis=1)
+
+    def draw(self, screen):
+        import pygame as pg
+
+        if self.font is None:
+            self.font = pg.font.SysFont('Arial', 11)
+        pg.surfarray.blit_array(screen, self.pixels())
+        _, tile_rows, tile_cols = self.boards.shape
+        color = self.theme['palette']['text']
+        for index, stats in enumerate(self.stats):
+            if stats is None:
+                continue
+            if self.labels[index] is None:
+                score, lines, game_over = stats
+                self.labels[index] = self.font.render(f'{score} / {lines}{" x" if game_over else ""}', True, color)
+            line, column = divmod(index, self.columns)
+            screen.blit(self.labels[index], (column * tile_cols * self.cell_size,
+                                             (line * tile_rows + self.board_rows) * self.cell_size))
+
+
+class RenderProcess:
+    """Draws snapshots in a window owned by another process, so rendering never slows the simulation.
+
+    view is a BoardView or a MosaicView, and submit takes its updates. submit never blocks: when the renderer
+    hasn't taken the previous updates yet, the oldest one is dropped and counted in dropped. The queue and
+    closed_event can be handed to other processes to submit from there, see submit_latest."""
+
+    def __init__(self, view=None, fps=commons.target_fps, max_pending=2):
+        context = multiprocessing.get_context('spawn')
+        self.queue = context.Queue(maxsize=max_pending)
+        self.closed_event = context.Event()
+        self.dropped = 0
+        self.process = context.Process(target=render_main,
+                                       args=(view if view is not None else BoardView(), self.queue,
+                                             self.closed_event, fps),
+                                       name='tetrai-render', daemon=True)
+        self.process.start()
+
+    @property
+    def closed(self):
+        """The window was closed, or the renderer died."""
+        return self.closed_event.is_set() or not self.process.is_alive()
+
+    def submit(self, update):
+        self.dropped += submit_latest(self.queue, update)
+
+    def close(self):
+        self.closed_event.set()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+
+def submit_latest(updates, update):
+    """Queue an update without blocking, dropping the oldest queued one when the queue is full, so the renderer
+    shows the latest state. Returns the number of updates dropped."""
+    try:
+        updates.put_nowait(update)
+        return 0
+    except queue.Full:
+        pass
+    try:
+        updates.get_nowait()
+    except queue.Empty:
+        pass
+    try:
+        updates.put_nowait(update)
+        return 1
+    except queue.Full:
+        # Another process filled it again, this one is the stale one now
+        return 2
+
+
+def draw_snapshot(screen, font, snapshot, lut, cell_size, theme):
+    import pygame as pg
+
+    margin = 1
+    pitch = cell_size + margin
+    screen.fill(theme['palette']['background'])
+    board = rasterize(snapshot['board'], lut, cell_size, margin)
+    board_x = (screen.get_width() - board.shape[0]) // 2
+    screen.blit(pg.surfarray.make_surface(board), (board_x, 0))
+    hold = rasterize(piece_board(snapshot['hold']), lut, cell_size)
+    screen.blit(pg.surfarray.make_surface(hold), (board_x - 5 * pitch, pitch))
+    for i, piece_type in enumerate(snapshot['preview']):
+        preview = rasterize(piece_board(piece_type), lut, cell_size)
+        screen.blit(pg.surfarray.make_surface(preview), (board_x + board.shape[0] + pitch, pitch + i * 3 * pitch))
+    lines = [f'Score: {snapshot["score"]}', f'Lines: {snapshot["lines"]}', f'Pieces: {snapshot["pieces"]}']
+    if snapshot['game_over']:
+        lines.append('Game over')
+    elif snapshot['paused']:
+        lines.append('Paused')
+    for i, line in enumerate(lines):
+        screen.blit(font.render(line, True, theme['palette']['text']), (10, screen.get_height() // 2 + i * 24))
+
+
+def render_main(view, updates, closed, fps):
+    """Renderer process: applies the queued updates to the view and draws it at most fps times a second,
+    only when something came in, until closed."""
+    import pygame as pg
+
+    pg.init()
+    pg.display.set_caption('TetrAI')
+    screen = pg.display.set_mode(view.size())
+    clock = pg.time.Clock()
+    try:
+        while not closed.is_set():
+            for event in pg.event.get():
+                if event.type == pg.QUIT or event.type == pg.KEYDOWN and event.key == pg.K_ESCAPE:
+                    closed.set()
+            # Older single board snapshots are simply overwritten
+            changed = False
+            try:
+                while True:
+                    view.update(updates.get_nowait())
+                    changed = True
+            except queue.Empty:
+                pass
+            if changed:
+                view.draw(screen)
+                pg.display.flip()
+            clock.tick(fps)
+    except KeyboardInterrupt:
+        # Ctrl+C reaches the whole process group, the parent closes the renderer
+        pass
+    pg.quit()
@@ -0,0 +1,60 @@
+import json
+
+from gameengine import Event, Listener, LogicObject
+
+
+class Recorder(Listener):
+    """Collects the locked pieces of every game played on a PlayField."""
+
+    def __init__(self, field, seed=None):
+        Listener.__init__(self)
+        self.field = field
+        self.seed = seed
+        self.games = []
+        field.connect(Event("game_over"), self, self.on_event)
+
+    def on_event(self, event: Event):
+        if event.message == "game_over":
+            self.games.append(list(self.field.history))
+
+    def save(self, path):
+        """Save the finished games and the one in progress."""
+        games = self.games + ([list(self.field.history)] if self.field.history else [])
+        with open(path, 'w') as file:
+            json.dump({'seed': self.seed, 'games': games}, file)
+
+
+def load(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+class Replayer(LogicObject):
+    """Locks recorded pieces on a PlayField, one every delay seconds."""
+
+    def __init__(self, field, history, delay=0.25):
+        LogicObject.__init__(self)
+        self.field = field
+        self.history = history
+        self.delay = delay
+        self.time = 0.0
+        self.index = 0
+        # No gravity, lock delay or keyboard while replaying
+        field.pause()
+
+    @property
+    def busy(self):
+        return self.index < len(self.history)
+
+    def update(self, dt: float):
+        if self.index >= len(self.history):
+            return
+        self.time += dt
+        if self.time < self.delay:
+            return
+        self.time = 0.0
+        piece_type, x, y, rotation = self.history[self.index]
+        self.index += 1
+        self.field.current_piece_type = piece_type
+        self.field.place_piece(x, y, rotation)
+        self.field.pause()
@@ -0,0 +1,150 @@
+import socket
+import socketserver
+import struct
+import threading
+
+import numpy as np
+
+import headless
+import protocol
+from grid import PIECE_CELLS, Rotation
+from movegen import MoveGenerator
+
+
+class EnvironmentServer:
+    """Hosts headless PlayFields and answers batched protocol requests, see protocol."""
+
+    def __init__(self, envs=16):
+        self.fields = [headless.make_field() for _ in range(envs)]
+        self.generator = MoveGenerator()
+        # Requests of all connections go through the same games one at a time
+        self.lock = threading.Lock()
+        field = self.fields[0]
+        self.observation_dtype = protocol.observation_dtype(field.rows, field.cols, field.max_next_pieces)
+
+    def observations(self, envs):
+        observations = np.zeros(len(envs), dtype=self.observation_dtype)
+        for i, env in enumerate(envs):
+            field = self.fields[env]
+            observations['board'][i] = field.game_field.cells
+            observations['current_piece'][i] = field.current_piece_type
+            observations['hold'][i] = field.hold_piece_type if field.hold_piece_type is not None else 0
+            observations['preview'][i] = field.bag[:field.max_next_pieces]
+            observations['score'][i] = field.score
+            observations['lines'][i] = field.total_lines
+            observations['pieces'][i] = field.pieces_placed
+            observations['game_over'][i] = field.game_over
+        return observations.tobytes()
+
+    def env_ids(self, envs):
+        if len(envs) and int(envs.max()) >= len(self.fields):
+            raise IndexError(f'environment {int(envs.max())} out of {len(self.fields)}')
+        return [int(env) for env in envs]
+
+    def reset(self, items):
+        envs = self.env_ids(items['env'])
+        for env, seed in zip(envs, items['seed']):
+            field = self.fields[env]
+            field.rng = np.random.default_rng(int(seed) if seed >= 0 else None)
+            field.start_game()
+        return [self.observations(envs)]
+
+    def step(self, items):
+        envs = self.env_ids(items['env'])
+        moves = [(env, int(x), int(y), int(rotation) % 4)
+                 for env, x, y, rotation in zip(envs, items['x'], items['y'], items['rotation'])]
+        # Check the whole batch first, so a bad request doesn't step part of it. Every move is checked on the board
+        # before the batch, so an environment can only be stepped once per batch
+        if len(set(envs)) != len(envs):
+            raise ValueError('an environment appears more than once in the batch')
+        for env, x, y, rotation in moves:
+            field = self.fields[env]
+            if field.game_over:
+                continue
+            footprint = frozenset((x + dx, y + dy) for dx, dy in PIECE_CELLS[field.current_piece_type][rotation])
+            if footprint not in {frozenset(p.cells()) for p in self.generator.field_placements(field)}:
+                raise ValueError(f'environment {env}: ({x}, {y}, {rotation}) is not a reachable placement')
+        results = np.zeros(len(envs), dtype=protocol.STEP_RESULT)
+        for i, (env, x, y, rotation) in enumerate(moves):
+            field = self.fields[env]
+            if not field.game_over:
+                field.place_piece(x, y, rotation)
+                results['reward'][i] = field.last_lock_reward
+                spawn_x, spawn_y, spawn_rotation = field.spawn_position()
+                if not field.game_over and not field.game_field.can_show_piece(
+                        field.current_piece_type, Rotation(spawn_rotation), spawn_x, spawn_y):
+                    # Blocked at spawn
+                    field.game_over = True
+            results['done'][i] = field.game_over
+        return [results.tobytes(), self.observations(envs)]
+
+    def placements(self, envs):
+        parts = []
+        for env in self.env_ids(envs):
+            field = self.fields[env]
+            placements = self.generator.field_placements(field) if not field.game_over else ()
+            packed = np.array([(p.x, p.y, p.rotation) for p in placements], dtype=protocol.PLACEMENT)
+            parts += [protocol.COUNT.pack(len(packed)), packed.tobytes()]
+        return parts
+
+    def handle(self, request):
+        """Reply parts for a request payload."""
+        opcode = request[0]
+        if opcode == protocol.INFO:
+            field = self.fields[0]
+            return [protocol.INFO_REPLY.pack(len(self.fields), field.rows, field.cols, field.max_next_pieces)]
+        count, = protocol.COUNT.unpack_from(request, 1)
+        item_dtype = {protocol.RESET: protocol.RESET_ITEM, protocol.STEP: protocol.STEP_ITEM,
+                      protocol.PLACEMENTS: protocol.ENV_ID}.get(opcode)
+        if item_dtype is None:
+            raise ValueError(f'unknown opcode {opcode}')
+        items = np.frombuffer(request, dtype=item_dtype, count=count, offset=1 + protocol.COUNT.size)
+        match opcode:
+            case protocol.RESET:
+                return self.reset(items)
+            case protocol.STEP:
+                return self.step(items)
+            case protocol.PLACEMENTS:
+                return self.placements(items)
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        if self.request.family == socket.AF_INET:
+            self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def handle(self):
+        environments = self.server.environments
+        while True:
+            try:
+                request = protocol.receive_message(self.request)
+            except ConnectionError:
+                return
+            try:
+                with environments.lock:
+                    reply = [bytes([protocol.OK])] + environments.handle(request)
+            except (ValueError, IndexError, struct.error) as error:
+                reply = [bytes([protocol.ERROR]), str(error).encode()]
+            protocol.send_message(self.request, *reply)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(address='127.0.0.1:5555', envs=16):
+    """Serve environments until interrupted. Address is <host>:<port> or unix:<path>."""
+    family, bind_address = protocol.parse_address(address)
+    server_class = _UnixServer if family == socket.AF_UNIX else _TCPServer
+    with server_class(bind_address, _RequestHandler) as server:
+        server.environments = EnvironmentServer(envs)
+        print(f'Serving {envs} environments on {address}')
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,249 @@
+"""Hyperparameter sweeps of the actor-critic agent, trials trained on headless games in parallel processes.
+
+A search space maps parameter names to a list of values, or for random search to a range
+{"low": ..., "high": ..., "log": true/false}, integer when both bounds are. Agent parameters are the
+arguments of Agent, reward parameters the keys of grid.AGENT_SCORE_SCHEME. Every trial plays the same
+seeded games, and trials falling behind the others are stopped early, see MedianStopping. Trials are compared
+on the game score by default, the agent rewards of different reward parameters don't compare.
+"""
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+from time import perf_counter
+
+import numpy as np
+
+AGENT_PARAMS = ('alpha', 'beta', 'gamma', 'epsilon', 'epsilon_decay', 'epsilon_min', 'layer1_size', 'layer2_size')
+REWARD_PARAMS = ('move_delta_score', 'game_over_delta_score', 'non_line_clear_delta_score')
+# Learning rates of EnvironmentManager, Agent has no defaults for them
+DEFAULT_AGENT_PARAMS = {'alpha': 0.00001, 'beta': 0.00005}
+DEFAULT_SPACE = {'alpha': [0.000001, 0.00001, 0.0001],
+                 'beta': [0.00001, 0.00005, 0.0005],
+                 'non_line_clear_delta_score': [0, 8, 32],
+                 'game_over_delta_score': [-100, -1000]}
+
+
+def check_space(space):
+    unknown = set(space) - set(AGENT_PARAMS) - set(REWARD_PARAMS)
+    if unknown:
+        raise ValueError(f'Unknown parameters: {", ".join(sorted(unknown))}')
+
+
+def grid_trials(space):
+    """Every combination of the values of a space."""
+    check_space(space)
+    for name, values in space.items():
+        if not isinstance(values, list):
+            raise ValueError(f'{name}: grid search needs a list of values')
+    names = list(space)
+    return [dict(zip(names, values)) for values in itertools.product(*(space[name] for name in names))]
+
+
+def random_trials(space, count, seed=0):
+    """count parameter sets sampled from a space."""
+    check_space(space)
+    rng = np.random.default_rng(seed)
+    trials = []
+    for _ in range(count):
+        params = {}
+        for name, values in space.items():
+            if isinstance(values, list):
+                params[name] = values[rng.integers(len(values))]
+            elif isinstance(values['low'], int) and isinstance(values['high'], int):
+                params[name] = int(rng.integers(values['low'], values['high'] + 1))
+            elif values.get('log', False):
+                params[name] = float(np.exp(rng.uniform(np.log(values['low']), np.log(values['high']))))
+            else:
+                params[name] = float(rng.uniform(values['low'], values['high']))
+        trials.append(params)
+    return trials
+
+
+class MedianStopping:
+    """Median stopping rule: after grace episodes, a trial whose mean metric over its last window episodes is
+    below the median of the other trials' at the same episode is stopped. Needs min_trials trials to compare."""
+
+    def __init__(self, metric='score', grace=20, window=10, min_trials=3):
+        self.metric = metric
+        self.grace = grace
+        self.window = window
+        self.min_trials = min_trials
+        self.values = {}
+        # Trial -> running mean after each episode
+        self.means = {}
+
+    def report(self, trial, record):
+        """Add an episode record of a trial. Returns whether the trial should stop."""
+        values = self.values.setdefault(trial, [])
+        values.append(record[self.metric])
+        means = self.means.setdefault(trial, [])
+        means.append(float(np.mean(values[-self.window:])))
+        episode = len(means)
+        if episode < self.grace:
+            return False
+        others = [other[episode - 1] for key, other in self.means.items() if key != trial and len(other) >= episode]
+        if len(others) + 1 < self.min_trials:
+            return False
+        return means[-1] < np.median(others)
+
+
+def run_trial(trial, params, reports, stops, directory, episodes, seed, max_pieces):
+    """Train a fresh agent for episodes games, streaming every episode to reports and to its metrics file,
+    until done or stopped."""
+    from agent import Agent, train_episode
+    import headless
+    from grid import AGENT_SCORE_SCHEME
+    from metrics import MetricsWriter
+    from movegen import MoveGenerator
+
+    agent_params = dict(DEFAULT_AGENT_PARAMS, **{name: value for name, value in params.items()
+                                                 if name in AGENT_PARAMS})
+    score_scheme = dict(AGENT_SCORE_SCHEME, **{name: value for name, value in params.items()
+                                               if name in REWARD_PARAMS})
+    trial_dir = os.path.join(directory, f'trial-{trial:04d}')
+    np.random.seed(seed + trial)
+    agent = Agent(checkpoint_dir=trial_dir, **agent_params)
+    field = headless.make_field(agent_score_scheme=score_scheme)
+    generator = MoveGenerator()
+    writer = MetricsWriter(os.path.join(trial_dir, 'episodes.jsonl'))
+    start = perf_counter()
+    try:
+        for episode in range(1, episodes + 1):
+            # Same games for every trial
+            field.rng = np.random.default_rng(seed + episode)
+            field.start_game()
+            record = dict(train_episode(agent, field, generator, max_pieces), episode=episode,
+                          epsilon=float(agent.epsilon), seconds=perf_counter() - start)
+            writer.log(**record)
+            reports.put((trial, 'episode', record))
+            if stops[trial]:
+                reports.put((trial, 'stopped', None))
+                return
+        reports.put((trial, 'done', None))
+    finally:
+        writer.close()
+
+
+def trial_worker(jobs, reports, stops, directory, episodes, seed, max_pieces):
+    """Worker process: runs the queued trials one after the other."""
+    # One core per trial, the sweep is parallel across trials
+    for variable in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS'):
+        os.environ.setdefault(variable, '1')
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            trial, params = job
+            try:
+                run_trial(trial, params, reports, stops, directory, episodes, seed, max_pieces)
+            except Exception as error:
+                reports.put((trial, 'failed', repr(error)))
+    except KeyboardInterrupt:
+        pass
+
+
+def summarize_trial(trial, params, status, records, window):
+    last = records[-window:]
+    row = {'trial': trial, 'status': status, 'episodes': len(records)}
+    row.update(params)
+    for metric in ('reward', 'score', 'lines', 'pieces'):
+        row[f'{metric}_mean'] = float(np.mean([record[metric] for record in last])) if last else float('nan')
+    row['score_max'] = max((record['score'] for record in records), default=float('nan'))
+    row['seconds'] = records[-1]['seconds'] if records else 0.0
+    return row
+
+
+def write_results(path, rows):
+    columns = list(dict.fromkeys(column for row in rows for column in row))
+    with open(path, 'w', newline='') as file:
+        writer = csv.DictWriter(file, columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def print_results(rows, top=10):
+    print(f'{"trial":>5} {"status":8} {"episodes":>8} {"reward":>10} {"score":>10} {"lines":>8}  params')
+    for row in rows[:top]:
+        params = ', '.join(f'{name}={row[name]:g}' for name in AGENT_PARAMS + REWARD_PARAMS if name in row)
+        print(f'{row["trial"]:5} {row["status"]:8} {row["episodes"]:8} {row["reward_mean"]:10.1f} '
+              f'{row["score_mean"]:10.1f} {row["lines_mean"]:8.1f}  {params}')
+
+
+def sweep(trials, directory, episodes=100, workers=None, seed=0, max_pieces=None, stopping=None):
+    """Run trials (lists of parameter dicts) across worker processes. Returns the result rows, best first by
+    the mean stopping metric over the last episodes, also written to results.csv in directory."""
+    stopping = stopping if stopping is not None else MedianStopping()
+    workers = min(workers if workers is not None else os.cpu_count(), len(trials))
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, 'trials.json'), 'w') as file:
+        json.dump(trials, file, indent=2)
+
+    context = multiprocessing.get_context('spawn')
+    jobs = context.Queue()
+    reports = context.Queue()
+    # Set by the parent, checked by the trial after every episode
+    stops = context.Array('b', len(trials), lock=False)
+    for job in enumerate(trials):
+        jobs.put(job)
+    for _ in range(workers):
+        jobs.put(None)
+    processes = [context.Process(target=trial_worker,
+                                 args=(jobs, reports, stops, directory, episodes, seed, max_pieces), daemon=True)
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+
+    records = {trial: [] for trial in range(len(trials))}
+    statuses = {}
+    try:
+        while len(statuses) < len(trials):
+            try:
+                trial, kind, value = reports.get(timeout=1.0)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            if kind == 'episode':
+                records[trial].append(value)
+                if not stops[trial] and stopping.report(trial, value):
+                    stops[trial] = 1
+                    print(f'trial {trial}: stopped at episode {value["episode"]}')
+            else:
+                statuses[trial] = kind
+                print(f'trial {trial}: {kind}{f" ({value})" if value is not None else ""}, '
+                      f'{len(statuses)}/{len(trials)} finished')
+    except KeyboardInterrupt:
+        print('Interrupted, writing the results so far')
+        for trial in range(len(trials)):
+            stops[trial] = 1
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()
+
+    rows = [summarize_trial(trial, params, statuses.get(trial, 'unfinished'), records[trial], stopping.window)
+            for trial, params in enumerate(trials)]
+    rows.sort(key=lambda row: -row[f'{stopping.metric}_mean'] if records[row['trial']] else float('inf'))
+    write_results(os.path.join(directory, 'results.csv'), rows)
+    return rows
+
+
+def main(space=None, search='grid', trials=20, directory='sweeps', episodes=100, workers=None, seed=0,
+         max_pieces=None, metric='score', grace=20, window=10):
+    """Sweep a search space, given as a dict or a JSON file path, DEFAULT_SPACE by default."""
+    if space is None:
+        space = DEFAULT_SPACE
+    elif isinstance(space, str):
+        with open(space) as file:
+            space = json.load(file)
+    trial_params = grid_trials(space) if search == 'grid' else random_trials(space, trials, seed)
+    print(f'{len(trial_params)} trials of {episodes} episodes')
+    rows = sweep(trial_params, directory, episodes, workers, seed, max_pieces,
+                 MedianStopping(metric, grace, window))
+    print_results(rows)
+    print(f'Results written to {os.path.join(directory, "results.csv")}')
+    return rows
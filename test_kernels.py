@@ -0,0 +1,105 @@
+"""The kernels must give the same results as the Python code they replace, see kernels.
+
+Runs the uncompiled kernels when numba is missing. Run with python -m pytest test_kernels.py"""
+import numpy as np
+import pytest
+
+import grid
+import headless
+import kernels
+from grid import Rotation
+from movegen import search_placements
+
+SEEDS = range(50)
+SEARCH_SEEDS = range(20)
+
+
+def random_board(rng, rows=40, cols=10):
+    """Board with a random stack of random height and density, some of its rows full."""
+    height = int(rng.integers(4, 20))
+    cells = np.zeros((rows, cols), dtype=np.int8)
+    stack = (rng.random((height, cols)) < rng.uniform(0.3, 0.9)) * rng.choice(grid.PIECE_TYPES, (height, cols))
+    stack[rng.choice(height, int(rng.integers(0, 4)), replace=False)] = ord('X')
+    cells[rows - height:] = stack
+    return cells
+
+
+def show(cells):
+    """Text picture of the non-empty rows of a board, top row first."""
+    rows = [''.join('#' if cell else '.' for cell in row) for row in cells if row.any()]
+    return '\n'.join(rows) or '(empty)'
+
+
+def both(function):
+    """function() with the kernels disabled, then enabled."""
+    enabled = kernels.ENABLED
+    try:
+        results = []
+        for kernels.ENABLED in (False, True):
+            results.append(function())
+        return results
+    finally:
+        kernels.ENABLED = enabled
+
+
+def make_field(seed):
+    field = headless.make_field(seed=seed)
+    field.game_field.cells[:] = random_board(np.random.default_rng(seed))
+    field.game_field.update_surface()
+    return field
+
+
+def queries(seed, count=40):
+    rng = np.random.default_rng(seed + 1000)
+    return [(int(rng.choice(grid.PIECE_TYPES)), Rotation(int(rng.integers(4))), int(rng.integers(-3, 10)),
+             int(rng.integers(-3, 24))) for _ in range(count)]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_can_show_piece(seed):
+    field = make_field(seed)
+    for piece_type, rotation, x, y in queries(seed):
+        python, kernel = both(lambda: field.game_field.can_show_piece(piece_type, rotation, x, y))
+        assert python == kernel, f'{chr(piece_type)} rotation {rotation.get()} at ({x}, {y}) on\n' \
+                                 f'{show(field.game_field.cells)}'
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_landing_y(seed):
+    field = make_field(seed)
+    for piece_type, rotation, x, y in queries(seed):
+        if not field.game_field.can_show_piece(piece_type, rotation, x, y):
+            continue
+        python, kernel = both(lambda: field.game_field.landing_y(piece_type, rotation, x, y))
+        assert python == kernel, f'{chr(piece_type)} rotation {rotation.get()} from ({x}, {y}) on\n' \
+                                 f'{show(field.game_field.cells)}'
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_clear_full_rows(seed):
+    board = random_board(np.random.default_rng(seed))
+
+    def clear():
+        cells = board.copy()
+        cleared = grid.clear_full_rows(cells)
+        return list(cleared), cells.tobytes()
+
+    python, kernel = both(clear)
+    assert python == kernel, f'on\n{show(board)}'
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_fetch_features(seed):
+    field = make_field(seed)
+    python, kernel = both(lambda: field.fetch_features(0))
+    assert python == kernel, f'on\n{show(field.game_field.cells)}'
+
+
+@pytest.mark.parametrize('seed', SEARCH_SEEDS)
+@pytest.mark.parametrize('piece_type', grid.PIECE_TYPES)
+def test_search_placements(seed, piece_type):
+    field = make_field(seed)
+    x, y, rotation = field.spawn_position()
+    python, kernel = both(lambda: [(p.x, p.y, p.rotation, p.path)
+                                   for p in search_placements(field.game_field, piece_type, x, y, rotation)])
+    assert python == kernel, f'{chr(piece_type)} from ({x}, {y}, {rotation}) on\n{show(field.game_field.cells)}'
@@ -0,0 +1,67 @@
+import multiprocessing
+import os
+from time import perf_counter, sleep
+
+import numpy as np
+
+import headless
+from movegen import MoveGenerator
+from render import MosaicView, RenderProcess, snapshot, submit_latest
+
+
+def play_games(updates, closed, indices, spec, seed, fps, max_pieces=None):
+    """Worker process: plays its games one placement at a time, restarting them when they end, and submits
+    their snapshots at most fps times a second until the window is closed."""
+    from evaluate import make_policy
+
+    policy = make_policy(spec)
+    generator = MoveGenerator()
+    fields = {index: headless.make_field(seed=seed + index) for index in indices}
+    interval = 1 / fps
+    next_submit = 0.0
+    try:
+        while not closed.is_set():
+            for index, field in fields.items():
+                placements = generator.field_placements(field) if not field.game_over else ()
+                if not placements or max_pieces is not None and field.pieces_placed >= max_pieces:
+                    field.game_over = True
+                    continue
+                placement = policy.choose(field, placements)
+                field.place_piece(placement.x, placement.y, placement.rotation)
+            now = perf_counter()
+            if now >= next_submit:
+                submit_latest(updates, [(index, snapshot(field)) for index, field in fields.items()])
+                next_submit = now + interval
+                # Finished games are shown until the next refresh, then start over
+                for field in fields.values():
+                    if field.game_over:
+                        field.start_game()
+            if all(field.game_over for field in fields.values()):
+                sleep(interval)
+    except KeyboardInterrupt:
+        pass
+
+
+def main(games=36, spec='heuristic', workers=None, seed=0, fps=10, cell_size=4, max_pieces=None):
+    """Play games in worker processes and watch them all as a mosaic, until the window is closed."""
+    workers = min(workers if workers is not None else os.cpu_count(), games)
+    # Room for one update per worker and refresh
+    renderer = RenderProcess(MosaicView(games, cell_size=cell_size), fps, max_pending=2 * workers)
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=play_games,
+                                 args=(renderer.queue, renderer.closed_event, indices.tolist(), spec, seed, fps,
+                                       max_pieces),
+                                 daemon=True)
+                 for indices in np.array_split(np.arange(games), workers)]
+    for process in processes:
+        process.start()
+    try:
+        while not renderer.closed:
+            sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    renderer.close()
+    for process in processes:
+        process.join(timeout=5)
+        if process.is_alive():
+            process.terminate()